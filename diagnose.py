@@ -5,6 +5,8 @@ Run this if you encounter any issues
 
 import sys
 import os
+import importlib
+from importlib.util import find_spec
 
 print("=" * 70)
 print("  DIAGNOSTIC SCRIPT - Long-Form Memory System")
@@ -36,32 +38,44 @@ optional_packages = {
 missing_required = []
 missing_optional = []
 
-for package, name in required_packages.items():
+def import_error(package):
+    """
+    Import a package and return why it failed, or None if it imported
+
+    Actually importing (not just locating it) catches installed but broken
+    packages, such as a bad wheel or a native extension that won't load.
+    """
+    if find_spec(package) is None:
+        return "MISSING"
     try:
-        __import__(package)
+        importlib.import_module(package)
+    except Exception as e:
+        return f"BROKEN ({type(e).__name__}: {e})"
+    return None
+
+
+for package, name in required_packages.items():
+    error = import_error(package)
+    if error is None:
         print(f"   ✓ {name}")
-    except ImportError:
-        print(f"   ✗ {name} - MISSING (REQUIRED)")
+    else:
+        print(f"   ✗ {name} - {error} (REQUIRED)")
         missing_required.append(package)
 
 for package, name in optional_packages.items():
-    try:
-        __import__(package)
+    error = import_error(package)
+    if error is None:
         print(f"   ✓ {name}")
-    except ImportError:
-        print(f"   ⚠️  {name} - MISSING (Optional - will use fallback)")
+    else:
+        print(f"   ⚠️  {name} - {error} (Optional - will use fallback)")
         missing_optional.append(package)
 
 print()
 
 # Check data directory
 print("3. Checking data directory...")
-if os.path.exists("data"):
-    print("   ✓ Data directory exists")
-else:
-    print("   Creating data directory...")
-    os.makedirs("data/embeddings", exist_ok=True)
-    print("   ✓ Data directory created")
+os.makedirs("data/embeddings", exist_ok=True)
+print("   ✓ Data directory ready")
 print()
 
 # Fix suggestions
@@ -84,30 +98,23 @@ if missing_optional:
 
 # Test basic imports
 print("4. Testing core modules...")
-try:
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
-    from memory_extraction import MemoryExtractor
-    print("   ✓ Memory extraction module")
-except Exception as e:
-    print(f"   ✗ Memory extraction module: {e}")
-
-try:
-    from memory_storage import MemoryStorage
-    print("   ✓ Memory storage module")
-except Exception as e:
-    print(f"   ✗ Memory storage module: {e}")
-
-try:
-    from memory_retrieval import MemoryRetriever
-    print("   ✓ Memory retrieval module")
-except Exception as e:
-    print(f"   ✗ Memory retrieval module: {e}")
-
-try:
-    from conversation_agent import ConversationAgent
-    print("   ✓ Conversation agent module")
-except Exception as e:
-    print(f"   ✗ Conversation agent module: {e}")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+core_modules = {
+    'memory_extraction': 'Memory extraction module',
+    'memory_storage': 'Memory storage module',
+    'memory_retrieval': 'Memory retrieval module',
+    'conversation_agent': 'Conversation agent module',
+}
+
+for module, name in core_modules.items():
+    try:
+        # import_module returns the sys.modules entry for modules already
+        # pulled in as a dependency of an earlier one
+        importlib.import_module(module)
+        print(f"   ✓ {name}")
+    except Exception as e:
+        print(f"   ✗ {name}: {e}")
 
 print()
 
@@ -126,7 +133,7 @@ else:
     print("You can now run:")
     print("   python src/demo.py")
     print()
-    
+
 if missing_optional:
     print("💡 TIP: For best performance, install optional packages:")
     print(f"   pip install {' '.join(missing_optional)}")
@@ -3,28 +3,133 @@ API Server for Long-Form Memory System
 Provides REST endpoints for conversation processing
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import Flask, Response, request, jsonify
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
+import atexit
 import os
 import sys
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Add src directory to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from conversation_agent import ConversationAgent
-
 app = Flask(__name__)
-CORS(app)
 
-# Initialize agent
-agent = ConversationAgent(verbose=True)
+# CORS is only needed for the browser UI, so it is limited to the routes
+# web_interface.html calls. Set MEMORY_API_CORS_ORIGINS to a comma-separated
+# list of origins to restrict it further, or to an empty string to disable it.
+CORS_ORIGINS = os.environ.get("MEMORY_API_CORS_ORIGINS", "*")
+CORS_ROUTES = r"/(health|conversation|memories/.*)$"
+
+if CORS_ORIGINS:
+    from flask_cors import CORS
+    CORS(app, resources={
+        CORS_ROUTES: {
+            "origins": "*" if CORS_ORIGINS == "*" else CORS_ORIGINS.split(",")
+        }
+    })
+
+# Agent is created on first use so importing this module (or serving /health)
+# doesn't load the embedding model and vector index
+agent = None
+_agent_lock = threading.Lock()
+
+
+def get_agent():
+    """Return the shared conversation agent, creating it on first call"""
+    global agent
+    if agent is None:
+        with _agent_lock:
+            if agent is None:
+                from conversation_agent import ConversationAgent
+                # Store extracted memories off the request path, and answer
+                # a resubmitted turn from cache for a few seconds
+                agent = ConversationAgent(
+                    verbose=True,
+                    background_storage=True,
+                    response_cache_ttl=5.0
+                )
+    return agent
+
+
+@atexit.register
+def close_agent():
+    """Flush pending memory writes and the vector index at shutdown"""
+    if agent is not None:
+        agent.close()
+
+
+# Query parameter values that switch a flag on; anything else leaves it off
+TRUE_VALUES = frozenset({"1", "true", "yes", "on"})
+
+
+def json_response(payload):
+    """Serialize a payload to a JSON response, using orjson when installed"""
+    if orjson is None:
+        return jsonify(payload)
+    return Response(orjson.dumps(payload), mimetype='application/json')
+
+class ConversationRequest(BaseModel):
+    """Body of POST /conversation"""
+    session_id: str
+    user_message: str
+    turn_number: Optional[int] = None
+    retrieve_memories: bool = True
+
+
+class SearchRequest(BaseModel):
+    """Body of POST /search"""
+    query: str
+    session_id: Optional[str] = None
+    top_k: int = 5
+
+
+class BatchSearchRequest(BaseModel):
+    """Body of POST /search/batch"""
+    queries: List[str]
+    session_id: Optional[str] = None
+    top_k: int = 5
+
+
+def parse_body(model):
+    """
+    Decode and validate the request body against a pydantic model
+    
+    Returns:
+        (parsed model, None) on success, or (None, 400 error response)
+    """
+    try:
+        # Validates straight from the raw bytes, without building an
+        # intermediate dict through request.get_json()
+        return model.model_validate_json(request.get_data()), None
+    except ValidationError as e:
+        missing = [
+            ".".join(str(part) for part in error["loc"])
+            for error in e.errors()
+            if error["type"] == "missing"
+        ]
+        if missing:
+            message = f"Missing required fields: {', '.join(missing)}"
+        else:
+            first = e.errors()[0]
+            field = ".".join(str(part) for part in first["loc"])
+            message = f"Invalid request body: {field + ': ' if field else ''}{first['msg']}"
+        return None, (json_response({"error": message}), 400)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return json_response({
         "status": "healthy",
-        "memory_enabled": agent.enable_memory
+        # Don't force agent construction just to answer a health probe;
+        # the agent is always created with memory enabled
+        "memory_enabled": agent.enable_memory if agent is not None else True
     })
 
 @app.route('/conversation', methods=['POST'])
@@ -39,32 +144,31 @@ def process_conversation():
         "turn_number": int (optional),
         "retrieve_memories": bool (optional, default: true)
     }
+    
+    Query parameters:
+    - minimal: Set to 1 (or true/yes/on) to return only session_id,
+      turn_number and assistant_response (optional)
     """
     try:
-        data = request.get_json()
+        body, error = parse_body(ConversationRequest)
+        if error:
+            return error
         
-        if not data or 'session_id' not in data or 'user_message' not in data:
-            return jsonify({
-                "error": "Missing required fields: session_id, user_message"
-            }), 400
-        
-        session_id = data['session_id']
-        user_message = data['user_message']
-        turn_number = data.get('turn_number')
-        retrieve_memories = data.get('retrieve_memories', True)
+        minimal = request.args.get('minimal', '').lower() in TRUE_VALUES
         
         # Process turn
-        response = agent.process_turn(
-            session_id=session_id,
-            user_message=user_message,
-            turn_number=turn_number,
-            retrieve_memories=retrieve_memories
+        response = get_agent().process_turn(
+            session_id=body.session_id,
+            user_message=body.user_message,
+            turn_number=body.turn_number,
+            retrieve_memories=body.retrieve_memories,
+            minimal=minimal
         )
         
-        return jsonify(response)
+        return json_response(response)
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             "error": str(e)
         }), 500
 
@@ -76,25 +180,47 @@ def get_memories(session_id):
     Query parameters:
     - type: Filter by memory type (optional)
     - min_confidence: Minimum confidence threshold (optional)
+    - limit: Maximum number of memories to return (optional)
+    - offset: Number of memories to skip, for paging (optional, default: 0)
     """
     try:
         memory_type = request.args.get('type')
         min_confidence = float(request.args.get('min_confidence', 0.0))
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
         
-        memories = agent.storage.get_session_memories(
+        # Include memories from turns still being stored in the background
+        current_agent = get_agent()
+        current_agent.flush_session(session_id)
+        
+        memories = current_agent.storage.get_session_memories(
             session_id=session_id,
             memory_type=memory_type,
-            min_confidence=min_confidence
+            min_confidence=min_confidence,
+            limit=limit,
+            offset=offset
         )
         
-        return jsonify({
+        # A page holds only part of the memories; count them all so clients
+        # can tell how many pages there are
+        if limit is None and offset == 0:
+            total_memories = len(memories)
+        else:
+            total_memories = current_agent.storage.count_session_memories(
+                session_id=session_id,
+                memory_type=memory_type,
+                min_confidence=min_confidence
+            )
+        
+        return json_response({
             "session_id": session_id,
-            "total_memories": len(memories),
+            "total_memories": total_memories,
+            "offset": offset,
             "memories": memories
         })
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             "error": str(e)
         }), 500
 
@@ -102,11 +228,11 @@ def get_memories(session_id):
 def get_session_summary(session_id):
     """Get session summary and statistics"""
     try:
-        summary = agent.get_session_summary(session_id)
-        return jsonify(summary)
+        summary = get_agent().get_session_summary(session_id)
+        return json_response(summary)
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             "error": str(e)
         }), 500
 
@@ -114,13 +240,13 @@ def get_session_summary(session_id):
 def clear_session(session_id):
     """Clear session and all its memories"""
     try:
-        agent.clear_session(session_id)
-        return jsonify({
+        get_agent().clear_session(session_id)
+        return json_response({
             "message": f"Session {session_id} cleared successfully"
         })
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             "error": str(e)
         }), 500
 
@@ -137,31 +263,71 @@ def search_memories():
     }
     """
     try:
-        data = request.get_json()
+        body, error = parse_body(SearchRequest)
+        if error:
+            return error
         
-        if not data or 'query' not in data:
-            return jsonify({
-                "error": "Missing required field: query"
-            }), 400
+        current_agent = get_agent()
+        current_agent.flush_session(body.session_id)
         
-        query = data['query']
-        session_id = data.get('session_id')
-        top_k = data.get('top_k', 5)
-        
-        results = agent.storage.search_memories_by_content(
-            query=query,
-            session_id=session_id,
-            top_k=top_k
+        results = current_agent.storage.search_memories_by_content(
+            query=body.query,
+            session_id=body.session_id,
+            top_k=body.top_k
         )
         
-        return jsonify({
-            "query": query,
+        return json_response({
+            "query": body.query,
             "total_results": len(results),
             "results": results
         })
     
     except Exception as e:
-        return jsonify({
+        return json_response({
+            "error": str(e)
+        }), 500
+
+@app.route('/search/batch', methods=['POST'])
+def search_memories_batch():
+    """
+    Search memories for several queries in one request
+    
+    Request body:
+    {
+        "queries": ["string", ...],
+        "session_id": "string" (optional),
+        "top_k": int (optional, default: 5)
+    }
+    """
+    try:
+        body, error = parse_body(BatchSearchRequest)
+        if error:
+            return error
+        
+        queries = body.queries
+        current_agent = get_agent()
+        current_agent.flush_session(body.session_id)
+        
+        batch_results = current_agent.storage.search_memories_by_contents(
+            queries=queries,
+            session_id=body.session_id,
+            top_k=body.top_k
+        )
+        
+        return json_response({
+            "total_queries": len(queries),
+            "results": [
+                {
+                    "query": query,
+                    "total_results": len(results),
+                    "results": results
+                }
+                for query, results in zip(queries, batch_results)
+            ]
+        })
+    
+    except Exception as e:
+        return json_response({
             "error": str(e)
         }), 500
 
@@ -169,11 +335,14 @@ def search_memories():
 def get_global_stats():
     """Get global memory statistics"""
     try:
-        stats = agent.storage.get_memory_stats()
-        return jsonify(stats)
+        current_agent = get_agent()
+        current_agent.flush_session()
+        
+        stats = current_agent.storage.get_memory_stats()
+        return json_response(stats)
     
     except Exception as e:
-        return jsonify({
+        return json_response({
             "error": str(e)
         }), 500
 
@@ -189,7 +358,12 @@ if __name__ == '__main__':
     print("  GET  /session/<session_id>      - Get session summary")
     print("  DELETE /session/<session_id>    - Clear session")
     print("  POST /search                    - Search memories")
+    print("  POST /search/batch              - Search memories (many queries)")
     print("  GET  /stats                     - Global statistics")
+    print("\nFor production use a WSGI server instead, e.g.:")
+    print("  gunicorn -w 4 --threads 2 wsgi:app")
     print("\n" + "=" * 60)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Development server only; debug mode is left off so the reloader doesn't
+    # import everything (and load the embedding model) twice
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
\ No newline at end of file
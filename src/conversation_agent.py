@@ -4,23 +4,98 @@ Main orchestrator for long-form memory-enabled conversations
 """
 
 import json
+import re
+import threading
 import time
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
 
 from memory_extraction import MemoryExtractor
 from memory_storage import MemoryStorage
 from memory_retrieval import MemoryRetriever
 
 
+# Rule patterns for the demo response generator, compiled once at import
+_CALL_TOMORROW_RE = re.compile(r"^(?=.*call)(?=.*tomorrow)", re.IGNORECASE | re.DOTALL)
+_LANGUAGE_RE = re.compile(r"language", re.IGNORECASE)
+_NAME_RE = re.compile(r"my name is|call me", re.IGNORECASE)
+_GREETING_RE = re.compile(r"\b(?:hello|hi|hey)\b", re.IGNORECASE)
+
+# Process-wide agents handed out by ConversationAgent.get_shared, keyed on
+# their constructor arguments
+_SHARED_AGENTS: Dict[tuple, "ConversationAgent"] = {}
+_SHARED_AGENTS_LOCK = threading.Lock()
+
+
+@dataclass
+class SessionState:
+    """Per-session bookkeeping (slotted to keep many sessions cheap)"""
+    __slots__ = ("created_at", "turn_count", "last_active")
+    
+    created_at: str
+    turn_count: int
+    last_active: str
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after a fixed time"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key, value):
+        """Cache a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+    
+    def discard_where(self, predicate):
+        """Drop the entries whose key satisfies predicate"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+
 class ConversationAgent:
     """Main agent handling conversations with long-form memory"""
     
+    LLM_MODES = ("rules", "echo")
+    ECHO_RESPONSE = "Noted."
+    
     def __init__(
         self,
         db_path: str = "data/memories.db",
         enable_memory: bool = True,
-        verbose: bool = False
+        verbose: bool = False,
+        background_storage: bool = False,
+        embedding_model: Optional[str] = None,
+        response_cache_ttl: float = 0.0,
+        llm_mode: str = "rules"
     ):
         """
         Initialize conversation agent
@@ -29,27 +104,92 @@ class ConversationAgent:
             db_path: Path to memory database
             enable_memory: Whether to enable memory system
             verbose: Print detailed logs
+            background_storage: Persist extracted memories on a background
+                thread instead of before the turn returns
+            embedding_model: Sentence transformer for vector search
+                (defaults to MEMORY_EMBEDDING_MODEL or all-MiniLM-L6-v2)
+            response_cache_ttl: Seconds to replay the response to an
+                identical repeated turn instead of reprocessing it (0 disables)
+            llm_mode: "rules" for the rule-based replies, or "echo" to
+                answer every turn with a fixed string so benchmarks measure
+                only the memory system
         """
+        if llm_mode not in self.LLM_MODES:
+            raise ValueError(f"llm_mode must be one of {self.LLM_MODES}, got {llm_mode!r}")
+        
         self.verbose = verbose
+        self.llm_mode = llm_mode
         self.enable_memory = enable_memory
         
+        # Absorbs duplicate submissions (double clicks, client retries)
+        self._response_cache = TTLCache(ttl=response_cache_ttl) if response_cache_ttl > 0 else None
+        
+        # A single writer thread keeps stores in submission order, so waiting
+        # on a session's latest write means all of its earlier writes are done
+        self._storage_pool = None
+        self._pending_writes: Dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+        
         if self.enable_memory:
             self.extractor = MemoryExtractor()
-            self.storage = MemoryStorage(db_path)
+            if embedding_model:
+                self.storage = MemoryStorage(db_path, embedding_model=embedding_model)
+            else:
+                self.storage = MemoryStorage(db_path)
             self.retriever = MemoryRetriever(self.storage)
             
+            if background_storage:
+                self._storage_pool = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix="memory-storage"
+                )
+            
             if self.verbose:
                 print("✓ Memory system initialized")
         
         # Session management
-        self.sessions = {}  # session_id -> session data
+        self.sessions: Dict[str, SessionState] = {}
+    
+    @classmethod
+    def get_shared(cls, **kwargs) -> "ConversationAgent":
+        """
+        Return the process-wide agent for a configuration, creating it once
+        
+        Callers that run several demos or evaluations in one process reuse
+        the same storage connections and embedding model instead of
+        reloading them. End work with close_session() rather than close(),
+        and call close_shared() once at exit.
+        
+        Args:
+            **kwargs: ConversationAgent constructor arguments
+            
+        Returns:
+            The shared agent for these arguments
+        """
+        key = tuple(sorted(kwargs.items()))
+        with _SHARED_AGENTS_LOCK:
+            agent = _SHARED_AGENTS.get(key)
+            if agent is None:
+                agent = cls(**kwargs)
+                _SHARED_AGENTS[key] = agent
+        return agent
+    
+    @classmethod
+    def close_shared(cls):
+        """Close and forget every agent created by get_shared"""
+        with _SHARED_AGENTS_LOCK:
+            agents = list(_SHARED_AGENTS.values())
+            _SHARED_AGENTS.clear()
+        for agent in agents:
+            agent.close()
     
     def process_turn(
         self,
         session_id: str,
         user_message: str,
         turn_number: Optional[int] = None,
-        retrieve_memories: bool = True
+        retrieve_memories: bool = True,
+        minimal: bool = False
     ) -> Dict[str, Any]:
         """
         Process a single conversation turn
@@ -59,38 +199,51 @@ class ConversationAgent:
             user_message: User's input message
             turn_number: Turn number (auto-incremented if not provided)
             retrieve_memories: Whether to retrieve and inject memories
+            minimal: Return only the session, turn number and reply,
+                skipping the memory and performance metadata
             
         Returns:
             Response dictionary with message and metadata
         """
-        start_time = time.time()
-        
-        # Initialize session if needed
-        if session_id not in self.sessions:
-            self.sessions[session_id] = {
-                "created_at": datetime.utcnow().isoformat(),
-                "turn_count": 0,
-                "last_active": datetime.utcnow().isoformat()
-            }
+        # Without a turn number, a repeated message is a new turn to count
+        # and extract from, not a resubmission of the previous one
+        if self._response_cache is None or turn_number is None:
+            return self._process_turn(
+                session_id, user_message, turn_number, retrieve_memories, minimal
+            )
         
-        # Increment turn count
-        if turn_number is None:
-            self.sessions[session_id]["turn_count"] += 1
-            turn_number = self.sessions[session_id]["turn_count"]
-        else:
-            self.sessions[session_id]["turn_count"] = max(
-                self.sessions[session_id]["turn_count"], 
-                turn_number
+        key = (session_id, user_message, turn_number, retrieve_memories, minimal)
+        response = self._response_cache.get(key)
+        if response is None:
+            response = self._process_turn(
+                session_id, user_message, turn_number, retrieve_memories, minimal
             )
+            self._response_cache.set(key, response)
         
-        self.sessions[session_id]["last_active"] = datetime.utcnow().isoformat()
+        # Callers get their own copy, so changing it can't alter later hits
+        return dict(response)
+    
+    def _process_turn(
+        self,
+        session_id: str,
+        user_message: str,
+        turn_number: Optional[int],
+        retrieve_memories: bool,
+        minimal: bool
+    ) -> Dict[str, Any]:
+        """Run the retrieve -> respond -> extract pipeline for one turn"""
+        start_ns = time.perf_counter_ns()
+        turn_number = self._advance_session(session_id, turn_number)
         
         # Step 1: Retrieve relevant memories
         relevant_memories = []
-        retrieval_time = 0.0  # Initialize variable
+        retrieval_ns = 0  # Initialize variable
         
         if self.enable_memory and retrieve_memories and turn_number > 1:
-            retrieval_start = time.time()
+            retrieval_start = time.perf_counter_ns()
+            
+            # Earlier turns' memories must be stored before we search them
+            self.flush_session(session_id)
             
             relevant_memories = self.retriever.retrieve_relevant_memories(
                 session_id=session_id,
@@ -99,10 +252,10 @@ class ConversationAgent:
                 max_memories=5
             )
             
-            retrieval_time = (time.time() - retrieval_start) * 1000
+            retrieval_ns = time.perf_counter_ns() - retrieval_start
             
             if self.verbose:
-                print(f"✓ Retrieved {len(relevant_memories)} memories in {retrieval_time:.1f}ms")
+                print(f"✓ Retrieved {len(relevant_memories)} memories in {retrieval_ns / 1e6:.1f}ms")
         
         # Step 2: Format memories for prompt
         memory_context = ""
@@ -114,7 +267,7 @@ class ConversationAgent:
         
         # Step 3: Generate response (using simple rule-based for demo)
         # In production, this would call an LLM with memory context injected
-        response_start = time.time()
+        response_start = time.perf_counter_ns()
         
         assistant_response = self._generate_response(
             user_message=user_message,
@@ -123,14 +276,15 @@ class ConversationAgent:
             relevant_memories=relevant_memories
         )
         
-        response_time = (time.time() - response_start) * 1000
+        response_ns = time.perf_counter_ns() - response_start
         
         # Step 4: Extract memories from this turn
         extracted_memories = []
-        extraction_time = 0.0  # Initialize variable
+        memories_pending = False
+        extraction_ns = 0  # Initialize variable
         
         if self.enable_memory:
-            extraction_start = time.time()
+            extraction_start = time.perf_counter_ns()
             
             raw_memories = self.extractor.extract_memories(
                 user_message=user_message,
@@ -143,20 +297,38 @@ class ConversationAgent:
             filtered_memories = self.extractor.filter_memories(raw_memories, min_confidence=0.6)
             unique_memories = self.extractor.deduplicate_memories(filtered_memories)
             
-            # Store memories
-            if unique_memories:
+            # Store memories. This turn's memories aren't needed to answer it,
+            # so in background mode they are queued; duplicates of stored
+            # memories are only dropped once the write runs, so the response
+            # flags them as pending rather than stored
+            if unique_memories and self._storage_pool is not None:
+                with self._pending_lock:
+                    self._pending_writes[session_id] = self._storage_pool.submit(
+                        self.storage.store_memories,
+                        unique_memories
+                    )
+                extracted_memories = unique_memories
+                memories_pending = True
+            elif unique_memories:
                 memory_ids = self.storage.store_memories(unique_memories)
                 extracted_memories = [
                     m for m, mid in zip(unique_memories, memory_ids) if mid != -1
                 ]
             
-            extraction_time = (time.time() - extraction_start) * 1000
+            extraction_ns = time.perf_counter_ns() - extraction_start
             
             if self.verbose:
-                print(f"✓ Extracted {len(extracted_memories)} memories in {extraction_time:.1f}ms")
+                print(f"✓ Extracted {len(extracted_memories)} memories in {extraction_ns / 1e6:.1f}ms")
+        
+        if minimal:
+            return {
+                "session_id": session_id,
+                "turn_number": turn_number,
+                "assistant_response": assistant_response
+            }
         
         # Calculate total latency
-        total_time = (time.time() - start_time) * 1000
+        total_ns = time.perf_counter_ns() - start_ns
         
         # Build response
         response = {
@@ -164,34 +336,164 @@ class ConversationAgent:
             "turn_number": turn_number,
             "user_message": user_message,
             "assistant_response": assistant_response,
+            # Stored rows and extractor output always carry these keys, and
+            # the retriever always sets relevance_score, so index directly
             "active_memories": [
                 {
-                    "memory_id": m.get("id"),
-                    "content": m.get("content"),
-                    "type": m.get("type"),
-                    "origin_turn": m.get("source_turn"),
-                    "relevance_score": m.get("relevance_score", 0)
+                    "memory_id": m["id"],
+                    "content": m["content"],
+                    "type": m["type"],
+                    "origin_turn": m["source_turn"],
+                    "relevance_score": m["relevance_score"]
                 }
                 for m in relevant_memories
             ],
             "extracted_memories": [
                 {
-                    "content": m.get("content"),
-                    "type": m.get("type"),
-                    "confidence": m.get("confidence")
+                    "content": m["content"],
+                    "type": m["type"],
+                    "confidence": m["confidence"]
                 }
                 for m in extracted_memories
             ],
+            # True when extracted_memories are queued for background storage
+            # and not yet stored; some may turn out to be duplicates
+            "memories_pending": memories_pending,
+            # Stage timings stay 0.0 when a stage is skipped; values are
+            # left unrounded and formatted by clients
             "performance": {
-                "total_latency_ms": round(total_time, 2),
-                "retrieval_latency_ms": round(retrieval_time, 2) if retrieve_memories else 0,
-                "response_latency_ms": round(response_time, 2),
-                "extraction_latency_ms": round(extraction_time, 2) if self.enable_memory else 0
-            }
+                "total_latency_ms": total_ns / 1e6,
+                "retrieval_latency_ms": retrieval_ns / 1e6,
+                "response_latency_ms": response_ns / 1e6,
+                "extraction_latency_ms": extraction_ns / 1e6
+            },
+            # Raw integer timings for benchmarks:
+            # (total, retrieval, response, extraction) in nanoseconds
+            "perf_ns": (total_ns, retrieval_ns, response_ns, extraction_ns)
         }
         
         return response
     
+    def process_turns_bulk(
+        self,
+        session_id: str,
+        turns: List[Tuple[str, int]]
+    ) -> int:
+        """
+        Ingest many turns at once without retrieval
+        
+        Meant for bulk-loading history (e.g. filler turns in evaluation).
+        Each turn gets the same extraction as
+        process_turn(..., retrieve_memories=False), but no reply is
+        generated (it would be discarded and extraction only reads the user
+        message) and all extracted memories are written in one storage
+        call, so the whole batch costs one transaction and one embedding
+        batch.
+        
+        Args:
+            session_id: Unique session identifier
+            turns: (user_message, turn_number) pairs
+            
+        Returns:
+            Number of memories stored
+        """
+        unique_memories = []
+        
+        for user_message, turn_number in turns:
+            turn_number = self._advance_session(session_id, turn_number)
+            
+            if not self.enable_memory:
+                continue
+            
+            raw_memories = self.extractor.extract_memories(
+                user_message=user_message,
+                assistant_response="",
+                turn_number=turn_number,
+                session_id=session_id
+            )
+            filtered_memories = self.extractor.filter_memories(raw_memories, min_confidence=0.6)
+            unique_memories.extend(self.extractor.deduplicate_memories(filtered_memories))
+        
+        if not unique_memories:
+            return 0
+        
+        self.flush_session(session_id)
+        memory_ids = self.storage.store_memories(unique_memories)
+        
+        if self.verbose:
+            print(f"✓ Bulk-stored {len(turns)} turns")
+        
+        return sum(1 for mid in memory_ids if mid != -1)
+    
+    def recall_batch(
+        self,
+        session_id: str,
+        queries: List[str],
+        turn_number: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieve memories for several queries without generating replies
+        
+        Nothing is extracted or stored and the session's turn count is not
+        advanced; this is a read-only lookup against the session's memories.
+        
+        Args:
+            session_id: Unique session identifier
+            queries: Query messages
+            turn_number: Turn the queries are asked at (used for recency)
+            
+        Returns:
+            One dict per query with the retrieved active_memories
+        """
+        if not self.enable_memory:
+            return [{"query": query, "active_memories": []} for query in queries]
+        
+        self.flush_session(session_id)
+        
+        batches = self.retriever.retrieve_relevant_memories_batch(
+            session_id=session_id,
+            current_turn=turn_number,
+            user_messages=queries,
+            max_memories=5
+        )
+        
+        return [
+            {
+                "query": query,
+                "active_memories": [
+                    {
+                        "memory_id": m["id"],
+                        "content": m["content"],
+                        "type": m["type"],
+                        "origin_turn": m["source_turn"],
+                        "relevance_score": m["relevance_score"]
+                    }
+                    for m in memories
+                ]
+            }
+            for query, memories in zip(queries, batches)
+        ]
+    
+    def _advance_session(self, session_id: str, turn_number: Optional[int]) -> int:
+        """Create or update session bookkeeping and resolve the turn number"""
+        now_iso = datetime.now(timezone.utc).isoformat()
+        
+        # Initialize session if needed
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = SessionState(created_at=now_iso, turn_count=0, last_active=now_iso)
+            self.sessions[session_id] = session
+        
+        # Increment turn count
+        if turn_number is None:
+            session.turn_count += 1
+            turn_number = session.turn_count
+        else:
+            session.turn_count = max(session.turn_count, turn_number)
+        
+        session.last_active = now_iso
+        return turn_number
+    
     def _generate_response(
         self,
         user_message: str,
@@ -207,38 +509,44 @@ class ConversationAgent:
         2. Call an LLM (GPT-4, Claude, etc.)
         3. Return the generated response
         """
-        # Simple rule-based responses for demo
-        message_lower = user_message.lower()
+        if self.llm_mode == "echo":
+            return self.ECHO_RESPONSE
         
+        # Simple rule-based responses for demo
         # Check for memory-dependent responses
-        if "call" in message_lower and "tomorrow" in message_lower:
-            # Look for time constraints in memories
-            time_constraints = [
-                m for m in relevant_memories 
-                if m.get("type") == "constraint" and "time" in m.get("key", "").lower()
-            ]
+        if _CALL_TOMORROW_RE.search(user_message):
+            # Look for the first time constraint in memories
+            constraint = next(
+                (
+                    m for m in relevant_memories
+                    if m.get("type") == "constraint" and "time" in (m.get("key") or "").lower()
+                ),
+                None
+            )
             
-            if time_constraints:
-                constraint = time_constraints[0]
+            if constraint:
                 return f"I'll make sure to call you tomorrow {constraint.get('value', '')} as you preferred."
             else:
                 return "I'll call you tomorrow. What time works best for you?"
         
-        elif "language" in message_lower or "preferred language" in message_lower:
+        elif _LANGUAGE_RE.search(user_message):
             return "I'll remember your language preference for our future conversations."
         
-        elif "my name is" in message_lower or "call me" in message_lower:
+        elif _NAME_RE.search(user_message):
             return "Got it! I'll remember that."
         
-        elif any(word in message_lower for word in ["hello", "hi", "hey"]):
+        elif _GREETING_RE.search(user_message):
             # Check for name preference
-            name_prefs = [
-                m for m in relevant_memories 
-                if m.get("type") == "preference" and m.get("key") == "name"
-            ]
+            name_pref = next(
+                (
+                    m for m in relevant_memories
+                    if m.get("type") == "preference" and m.get("key") == "name"
+                ),
+                None
+            )
             
-            if name_prefs:
-                name = name_prefs[0].get("value", "")
+            if name_pref:
+                name = name_pref.get("value", "")
                 return f"Hello {name}! How can I help you today?"
             else:
                 return "Hello! How can I help you today?"
@@ -255,16 +563,18 @@ class ConversationAgent:
         if session_id not in self.sessions:
             return {"error": "Session not found"}
         
-        session_data = self.sessions[session_id]
+        session = self.sessions[session_id]
         
         summary = {
             "session_id": session_id,
-            "created_at": session_data["created_at"],
-            "last_active": session_data["last_active"],
-            "total_turns": session_data["turn_count"]
+            "created_at": session.created_at,
+            "last_active": session.last_active,
+            "total_turns": session.turn_count
         }
         
         if self.enable_memory:
+            self.flush_session(session_id)
+            
             # Get memory statistics
             memory_stats = self.storage.get_memory_stats(session_id)
             retrieval_stats = self.retriever.get_retrieval_stats(session_id)
@@ -274,16 +584,58 @@ class ConversationAgent:
         
         return summary
     
+    def close_session(self, session_id: str):
+        """Finish a session's pending writes and drop its state, keeping its memories"""
+        if self.enable_memory:
+            self.flush_session(session_id)
+        self.sessions.pop(session_id, None)
+    
     def clear_session(self, session_id: str):
         """Clear session and its memories"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        self.sessions.pop(session_id, None)
+        
+        # Don't replay responses that were built from the cleared memories
+        if self._response_cache is not None:
+            self._response_cache.discard_where(lambda key: key[0] == session_id)
         
         if self.enable_memory:
+            # Don't let a queued write re-insert memories after the delete
+            self.flush_session(session_id)
             self.storage.delete_session_memories(session_id)
     
+    def flush_session(self, session_id: Optional[str] = None):
+        """
+        Block until background memory writes have finished
+        
+        Call before reading self.storage directly, so the read sees every
+        turn processed so far. Waits for one session's writes, or for all
+        sessions' when session_id is None.
+        """
+        with self._pending_lock:
+            if session_id is None:
+                pending = list(self._pending_writes.items())
+            elif session_id in self._pending_writes:
+                pending = [(session_id, self._pending_writes[session_id])]
+            else:
+                pending = []
+        
+        for pending_id, future in pending:
+            error = future.exception()
+            if error is not None:
+                print(f"Warning: Background memory storage failed: {error}")
+            
+            # Forget the write only once it is done, so concurrent callers
+            # still find it and wait too; a newer write stays queued
+            with self._pending_lock:
+                if self._pending_writes.get(pending_id) is future:
+                    del self._pending_writes[pending_id]
+    
     def close(self):
         """Clean up resources"""
+        if self._storage_pool is not None:
+            self._storage_pool.shutdown(wait=True)
+            self._pending_writes.clear()
+        
         if self.enable_memory:
             self.storage.close()
 
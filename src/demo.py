@@ -7,8 +7,12 @@ import sys
 import os
 import json
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import numpy as np
+
 sys.path.insert(0, os.path.dirname(__file__))
 
 from conversation_agent import ConversationAgent
@@ -46,7 +50,7 @@ def run_predefined_demo():
     """Run a predefined conversation demonstrating long-range memory"""
     print_header("PREDEFINED DEMO: Long-Range Memory Test")
     
-    agent = ConversationAgent(verbose=False)
+    agent = ConversationAgent.get_shared(verbose=False)
     session_id = f"demo_{int(time.time())}"
     
     # Conversation script with memory tests at different ranges
@@ -117,14 +121,14 @@ def run_predefined_demo():
     for mem_type, count in summary['retrieval_stats']['type_distribution'].items():
         print(f"   {mem_type.title()}: {count}")
     
-    agent.close()
+    agent.close_session(session_id)
 
 
 def run_interactive_demo():
     """Run interactive conversation mode"""
     print_header("INTERACTIVE MODE")
     
-    agent = ConversationAgent(verbose=True)
+    agent = ConversationAgent.get_shared(verbose=True)
     session_id = f"interactive_{int(time.time())}"
     
     print(f"\nSession ID: {session_id}")
@@ -188,17 +192,29 @@ def run_interactive_demo():
         except Exception as e:
             print(f"\nError: {e}")
     
-    agent.close()
+    agent.close_session(session_id)
 
 
-def run_benchmark():
-    """Run performance benchmark"""
+def run_benchmark(concurrency=4):
+    """
+    Run performance benchmark
+    
+    Turns are spread round-robin over `concurrency` sessions. Each session
+    keeps its turns in order (later turns depend on earlier memories), while
+    the sessions run side by side in a thread pool so one turn's storage
+    work overlaps another's retrieval and response. Replies come from the
+    "echo" mode so the numbers reflect the memory system alone.
+    
+    Args:
+        concurrency: Number of sessions in flight at once
+    """
     print_header("PERFORMANCE BENCHMARK")
     
-    agent = ConversationAgent(verbose=False)
-    session_id = f"benchmark_{int(time.time())}"
+    agent = ConversationAgent.get_shared(verbose=False, background_storage=True, llm_mode="echo")
+    run_id = int(time.time())
+    session_ids = [f"benchmark_{run_id}_{i}" for i in range(concurrency)]
     
-    print("\nTesting system performance across 1000 turns...")
+    print(f"\nTesting system performance across 1000 turns ({concurrency} sessions in flight)...")
     
     # Generate test messages
     test_messages = [
@@ -209,32 +225,51 @@ def run_benchmark():
         "My email is test@example.com"
     ]
     
-    latencies = []
-    memory_counts = []
-    
     num_turns = 1000
     print_interval = 100
     
-    start_time = time.time()
+    # perf_ns rows (total, retrieval, response, extraction), filled in
+    # completion order; `done` counts the filled rows
+    stages = ("retrieval", "response", "extraction")
+    perf_ns = np.empty((num_turns, 1 + len(stages)), dtype=np.int64)
+    memory_counts = np.empty(num_turns, dtype=np.int32)
+    done = 0
+    progress_lock = threading.Lock()
     
-    for turn in range(1, num_turns + 1):
-        # Cycle through test messages
-        msg = test_messages[(turn - 1) % len(test_messages)] + f" (turn {turn})"
-        
-        response = agent.process_turn(
-            session_id=session_id,
-            user_message=msg,
-            turn_number=turn
-        )
-        
-        latencies.append(response['performance']['total_latency_ms'])
-        memory_counts.append(len(response.get('active_memories', [])))
-        
-        if turn % print_interval == 0:
-            avg_latency = sum(latencies[-print_interval:]) / print_interval
-            print(f"Turn {turn}: Avg latency = {avg_latency:.1f}ms")
+    def run_session(session_id, turns):
+        nonlocal done
+        for turn in turns:
+            # Cycle through test messages
+            msg = test_messages[(turn - 1) % len(test_messages)] + f" (turn {turn})"
+            
+            response = agent.process_turn(
+                session_id=session_id,
+                user_message=msg,
+                turn_number=turn
+            )
+            
+            with progress_lock:
+                perf_ns[done] = response['perf_ns']
+                memory_counts[done] = len(response.get('active_memories', []))
+                done += 1
+                
+                if done % print_interval == 0:
+                    avg_latency = perf_ns[done - print_interval:done, 0].mean() / 1e6
+                    print(f"Turn {done}: Avg latency = {avg_latency:.1f}ms")
     
-    total_time = time.time() - start_time
+    start_ns = time.perf_counter_ns()
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(run_session, session_id, range(i + 1, num_turns + 1, concurrency))
+            for i, session_id in enumerate(session_ids)
+        ]
+        for future in futures:
+            future.result()
+    
+    total_time = (time.perf_counter_ns() - start_ns) / 1e9
+    latencies = perf_ns[:, 0] * 1e-6
+    stage_means = perf_ns[:, 1:].mean(axis=0) * 1e-6
     
     # Results
     print_header("BENCHMARK RESULTS")
@@ -243,16 +278,23 @@ def run_benchmark():
     print(f"   Total Turns: {num_turns}")
     print(f"   Total Time: {total_time:.2f}s")
     print(f"   Avg Time per Turn: {(total_time / num_turns) * 1000:.1f}ms")
-    print(f"   Min Latency: {min(latencies):.1f}ms")
-    print(f"   Max Latency: {max(latencies):.1f}ms")
-    print(f"   Avg Latency: {sum(latencies) / len(latencies):.1f}ms")
+    print(f"   Min Latency: {latencies.min():.1f}ms")
+    print(f"   Max Latency: {latencies.max():.1f}ms")
+    print(f"   Avg Latency: {latencies.mean():.1f}ms")
+    print("   Avg Stage Latency: " + " / ".join(
+        f"{stage} {mean:.1f}ms" for stage, mean in zip(stages, stage_means)
+    ))
     
-    summary = agent.get_session_summary(session_id)
+    total_memories = sum(
+        agent.get_session_summary(session_id)['memory_stats']['total_memories']
+        for session_id in session_ids
+    )
     print(f"\n📊 Memory Statistics:")
-    print(f"   Total Memories Stored: {summary['memory_stats']['total_memories']}")
-    print(f"   Avg Memories Retrieved: {sum(memory_counts) / len(memory_counts):.1f}")
+    print(f"   Total Memories Stored: {total_memories}")
+    print(f"   Avg Memories Retrieved: {memory_counts.mean():.1f}")
     
-    agent.close()
+    for session_id in session_ids:
+        agent.close_session(session_id)
 
 
 def main():
@@ -281,6 +323,9 @@ def main():
     
     except KeyboardInterrupt:
         print("\n\nExiting...")
+    
+    finally:
+        ConversationAgent.close_shared()
 
 
 if __name__ == "__main__":
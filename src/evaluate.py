@@ -8,18 +8,42 @@ import os
 import json
 import time
 import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from statistics import fmean
 from typing import List, Dict, Any, Tuple
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 sys.path.insert(0, os.path.dirname(__file__))
 
 from conversation_agent import ConversationAgent
 
+# Set MEMORY_EVAL_PARALLEL=1 to run the tests other than latency concurrently
+# (faster, but their printed output interleaves)
+PARALLEL_EVAL = os.environ.get("MEMORY_EVAL_PARALLEL", "0") != "0"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+ACCURACY_MESSAGE_TEMPLATE = "This is test message at turn {turn}. Remember this information."
+
+
+@lru_cache(maxsize=4096)
+def _tokenize(text: str) -> frozenset:
+    """Lowercased word tokens of a memory's content"""
+    return frozenset(_TOKEN_RE.findall(text.lower()))
+
 
 class MemoryEvaluator:
     """Evaluate memory system performance"""
 
     def __init__(self):
-        self.agent = ConversationAgent(verbose=False)
+        self.agent = ConversationAgent.get_shared(verbose=False)
         self.test_results = {
             "long_range_recall": [],
             "accuracy": [],
@@ -27,6 +51,57 @@ class MemoryEvaluator:
             "latency": [],
             "hallucination_check": [],
         }
+        self._results_lock = threading.Lock()
+
+    def run_all(self, run_id: str, parallel: bool = PARALLEL_EVAL):
+        """
+        Run every test, each against its own session
+
+        The tests share no session state, so in parallel mode they are
+        submitted to a thread pool and run concurrently. The latency test
+        always runs alone afterwards, so it measures the agent rather than
+        contention with the other tests.
+
+        Args:
+            run_id: Suffix used to build per-test session IDs
+            parallel: Run tests concurrently instead of sequentially
+        """
+        tests = {
+            "long_range_recall": self.test_long_range_recall,
+            "accuracy": self.test_accuracy_across_turns,
+            "retrieval_relevance": self.test_retrieval_relevance,
+            "latency": self.test_latency_impact,
+            "hallucination": self.test_hallucination_avoidance,
+        }
+
+        if not parallel:
+            for name, test in tests.items():
+                self._run_test(test, f"eval_{name}_{run_id}")
+            return
+
+        latency_test = tests.pop("latency")
+
+        with ThreadPoolExecutor(max_workers=len(tests)) as pool:
+            futures = {
+                pool.submit(self._run_test, test, f"eval_{name}_{run_id}"): name
+                for name, test in tests.items()
+            }
+            for future in as_completed(futures):
+                future.result()
+
+        self._run_test(latency_test, f"eval_latency_{run_id}")
+
+    def _run_test(self, test, session_id: str):
+        """Run one test and release its session from the shared agent"""
+        try:
+            test(session_id)
+        finally:
+            self.agent.close_session(session_id)
+
+    def _record(self, key: str, results):
+        """Store one test's results"""
+        with self._results_lock:
+            self.test_results[key] = results
 
     def test_long_range_recall(self, session_id: str) -> Dict[str, Any]:
         """
@@ -67,6 +142,8 @@ class MemoryEvaluator:
         results = []
 
         for i, test in enumerate(test_cases, 1):
+            kw_set = frozenset(test["expected_content_keywords"])
+
             # Setup turn - store memory
             setup_response = self.agent.process_turn(
                 session_id=session_id,
@@ -93,10 +170,7 @@ class MemoryEvaluator:
 
             for mem in active_memories:
                 # Check if memory matches expected criteria
-                content_lower = mem["content"].lower()
-                matches_keywords = any(
-                    kw in content_lower for kw in test["expected_content_keywords"]
-                )
+                matches_keywords = bool(kw_set & _tokenize(mem["content"]))
                 matches_type = mem["type"] == test["expected_memory_type"]
 
                 if matches_keywords and matches_type:
@@ -122,13 +196,13 @@ class MemoryEvaluator:
             print(f"    Recalled: {recalled}, Relevance: {relevance_score:.2f}")
 
         # Calculate metrics
-        recall_rate = sum(1 for r in results if r["recalled"]) / len(results)
-        avg_relevance = sum(r["relevance_score"] for r in results) / len(results)
+        recall_rate = fmean(r["recalled"] for r in results)
+        avg_relevance = fmean(r["relevance_score"] for r in results)
 
         print(f"\n  Overall Recall Rate: {recall_rate * 100:.1f}%")
         print(f"  Average Relevance: {avg_relevance:.2f}")
 
-        self.test_results["long_range_recall"] = results
+        self._record("long_range_recall", results)
 
         return {
             "recall_rate": recall_rate,
@@ -153,9 +227,15 @@ class MemoryEvaluator:
             (950, 1000),  # Very late
         ]
 
+        # Sample 5 turns from each range up front
+        sampled_turns = [
+            random.sample(range(start, end + 1), min(5, end - start + 1))
+            for start, end in turn_ranges
+        ]
+
         results = []
 
-        for start, end in turn_ranges:
+        for (start, end), sample_turns in zip(turn_ranges, sampled_turns):
             range_results = {
                 "range": f"{start}-{end}",
                 "memories_extracted": 0,
@@ -164,16 +244,13 @@ class MemoryEvaluator:
             }
 
             total_confidence = 0
-            total_latency = 0
+            turn_latencies = []
             total_extracted = 0
 
-            # Sample 5 turns from this range
-            sample_turns = random.sample(range(start, end + 1), min(5, end - start + 1))
-
             for turn in sample_turns:
                 response = self.agent.process_turn(
                     session_id=session_id,
-                    user_message=f"This is test message at turn {turn}. Remember this information.",
+                    user_message=ACCURACY_MESSAGE_TEMPLATE.format(turn=turn),
                     turn_number=turn,
                 )
 
@@ -183,13 +260,13 @@ class MemoryEvaluator:
                 if extracted:
                     total_confidence += sum(m["confidence"] for m in extracted)
 
-                total_latency += response["performance"]["total_latency_ms"]
+                turn_latencies.append(response["performance"]["total_latency_ms"])
 
             range_results["memories_extracted"] = total_extracted
             range_results["avg_confidence"] = (
                 total_confidence / total_extracted if total_extracted > 0 else 0
             )
-            range_results["avg_latency"] = total_latency / len(sample_turns)
+            range_results["avg_latency"] = fmean(turn_latencies)
 
             results.append(range_results)
 
@@ -198,7 +275,7 @@ class MemoryEvaluator:
             print(f"    Avg Confidence: {range_results['avg_confidence']:.2f}")
             print(f"    Avg Latency: {range_results['avg_latency']:.1f}ms")
 
-        self.test_results["accuracy"] = results
+        self._record("accuracy", results)
 
         return {"results": results}
 
@@ -254,11 +331,10 @@ class MemoryEvaluator:
             active_memories = response.get("active_memories", [])
 
             # Check relevance
-            relevant_count = 0
-            for mem in active_memories:
-                content_lower = mem["content"].lower()
-                if any(kw in content_lower for kw in test["expected_keywords"]):
-                    relevant_count += 1
+            kw_set = frozenset(test["expected_keywords"])
+            relevant_count = sum(
+                1 for mem in active_memories if kw_set & _tokenize(mem["content"])
+            )
 
             precision = relevant_count / len(active_memories) if active_memories else 0
 
@@ -274,10 +350,10 @@ class MemoryEvaluator:
             print(f"  Query: '{test['query']}'")
             print(f"    Precision: {precision * 100:.1f}%")
 
-        avg_precision = sum(r["precision"] for r in results) / len(results)
+        avg_precision = fmean(r["precision"] for r in results)
         print(f"\n  Average Precision: {avg_precision * 100:.1f}%")
 
-        self.test_results["retrieval_relevance"] = results
+        self._record("retrieval_relevance", results)
 
         return {"avg_precision": avg_precision, "results": results}
 
@@ -308,19 +384,17 @@ class MemoryEvaluator:
                 )
                 checkpoint_latencies.append(response["performance"]["total_latency_ms"])
 
-            avg_latency = sum(checkpoint_latencies) / len(checkpoint_latencies)
+            avg_latency = fmean(checkpoint_latencies)
             latencies.append({"turn": checkpoint, "avg_latency_ms": avg_latency})
 
             print(f"    Turn {checkpoint}: {avg_latency:.1f}ms")
 
         # Check if latency is sub-100ms
-        within_target = sum(1 for l in latencies if l["avg_latency_ms"] < 100) / len(
-            latencies
-        )
+        within_target = fmean(l["avg_latency_ms"] < 100 for l in latencies)
 
         print(f"\n  Turns within 100ms target: {within_target * 100:.1f}%")
 
-        self.test_results["latency"] = latencies
+        self._record("latency", latencies)
 
         return {"latencies": latencies, "within_100ms_rate": within_target}
 
@@ -348,11 +422,9 @@ class MemoryEvaluator:
 
         results = []
 
-        for query in fake_queries:
-            response = self.agent.process_turn(
-                session_id=session_id, user_message=query, turn_number=100
-            )
+        responses = self.agent.recall_batch(session_id, fake_queries, turn_number=100)
 
+        for query, response in zip(fake_queries, responses):
             # Check if any memories were retrieved (should be none or low relevance)
             active_memories = response.get("active_memories", [])
 
@@ -372,23 +444,24 @@ class MemoryEvaluator:
             status = "✓ PASS" if result["passed"] else "✗ FAIL"
             print(f"  Query: '{query}' - {status}")
 
-        pass_rate = sum(1 for r in results if r["passed"]) / len(results)
+        pass_rate = fmean(r["passed"] for r in results)
         print(f"\n  Pass Rate: {pass_rate * 100:.1f}%")
 
-        self.test_results["hallucination_check"] = results
+        self._record("hallucination_check", results)
 
         return {"pass_rate": pass_rate, "results": results}
 
     def _fill_conversation_gap(self, session_id: str, start_turn: int, end_turn: int):
         """Fill conversation with dummy turns to simulate long conversation"""
-        # Sample every 10th turn to reduce processing time
-        for turn in range(start_turn, end_turn + 1, 10):
-            self.agent.process_turn(
-                session_id=session_id,
-                user_message=f"Filler message for turn {turn}",
-                turn_number=turn,
-                retrieve_memories=False,  # Don't retrieve to speed up
-            )
+        # Sample every 10th turn to reduce processing time, and ingest them
+        # in one batch since filler turns never need retrieval
+        self.agent.process_turns_bulk(
+            session_id,
+            [
+                (f"Filler message for turn {turn}", turn)
+                for turn in range(start_turn, end_turn + 1, 10)
+            ],
+        )
 
     def generate_report(self) -> Dict[str, Any]:
         """Generate comprehensive evaluation report"""
@@ -421,14 +494,9 @@ def main():
     print("=" * 70)
 
     evaluator = MemoryEvaluator()
-    session_id = f"eval_{int(time.time())}"
 
     # Run all tests
-    evaluator.test_long_range_recall(session_id)
-    evaluator.test_accuracy_across_turns(session_id)
-    evaluator.test_retrieval_relevance(session_id)
-    evaluator.test_latency_impact(session_id)
-    evaluator.test_hallucination_avoidance(session_id)
+    evaluator.run_all(str(int(time.time())))
 
     # Generate report
     report = evaluator.generate_report()
@@ -439,12 +507,16 @@ def main():
 
     # Save report
     report_path = "evaluation_report.json"
-    with open(report_path, "w") as f:
-        json.dump(report, f, indent=2)
+    if orjson is not None:
+        with open(report_path, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    else:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
 
     print(f"\n✓ Full report saved to: {report_path}")
 
-    evaluator.agent.close()
+    ConversationAgent.close_shared()
 
 
 if __name__ == "__main__":
@@ -5,10 +5,17 @@ Identifies and extracts important information from conversation turns
 
 import re
 import json
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timezone
+from functools import lru_cache
+from dataclasses import dataclass
 from enum import Enum
 
+try:
+    import re2
+except ImportError:
+    re2 = None
+
 
 class MemoryType(Enum):
     """Types of memories that can be extracted"""
@@ -20,39 +27,208 @@ class MemoryType(Enum):
     ENTITY = "entity"
 
 
+@dataclass(frozen=True)
+class ExtractedMemory:
+    """
+    A memory as extracted from message text, before per-turn metadata
+    
+    Slotted and frozen: these are what the per-message cache holds and
+    shares between turns. to_dict() builds the stored memory dictionary.
+    """
+    __slots__ = ("type", "content", "key", "value", "confidence", "raw_text")
+    
+    type: str
+    content: str
+    key: str
+    value: Any
+    confidence: float
+    raw_text: str
+    
+    def to_dict(self, session_id: str, source_turn: int, created_at: str) -> Dict[str, Any]:
+        """Memory dictionary stamped with its session, turn and creation time"""
+        return {
+            "type": self.type,
+            "content": self.content,
+            "key": self.key,
+            "value": self.value,
+            "confidence": self.confidence,
+            "raw_text": self.raw_text,
+            "session_id": session_id,
+            "source_turn": source_turn,
+            "created_at": created_at,
+            "last_accessed": None,
+            "access_count": 0
+        }
+
+
+# RE2's \s and \S are ASCII-only; these classes match exactly what
+# Python's do
+_RE2_SPACE = r"[\t-\r\x1c-\x20\x85\pZ]"
+_RE2_NON_SPACE = r"[^\t-\r\x1c-\x20\x85\pZ]"
+
+
+def _compile_linear(pattern: str):
+    """
+    Compile a case-insensitive pattern with RE2 when it is installed
+    
+    RE2 matches in linear time, where `re` backtracks quadratically on the
+    fact patterns over long messages. Only use this for patterns free of
+    word, digit and word-boundary classes, which RE2 treats as ASCII-only.
+    """
+    if re2 is None:
+        return re.compile(pattern, re.IGNORECASE)
+    pattern = pattern.replace(r"\s", _RE2_SPACE).replace(r"\S", _RE2_NON_SPACE)
+    return re2.compile("(?i)" + pattern)
+
+
+# Fixed helper patterns, compiled once at import
+_ENTITY_RE = re.compile(r'\b([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\b')
+# Common words to skip as entities. _ENTITY_RE only matches titlecase
+# words, so these need no lowercasing to compare
+_TITLECASE_STOPS = frozenset({"I", "My", "The", "A", "An"})
+# Fact patterns are bounded so a long message can't make them backtrack
+_FACT_RE = _compile_linear(r"(\S.{0,80}?)\s+(?:is|are|was|were)\s+(.{1,120})")
+_MY_RE = re.compile(r"\bmy\s+([A-Za-z][\w\s]{1,60})", re.IGNORECASE)
+_PREFERENCE_KEY_PATTERNS = [
+    (re.compile(r"language\s+is\s+(\w+)", re.IGNORECASE), ("language", 1)),
+    (re.compile(r"prefer[s]?\s+(.+)", re.IGNORECASE), ("preference", 1)),
+    (re.compile(r"favorite\s+(.+)", re.IGNORECASE), ("favorite", 1)),
+    (re.compile(r"call me\s+(.+)", re.IGNORECASE), ("name", 1)),
+]
+_TIME_RE = re.compile(r"time|am|pm|\d+:\d+", re.IGNORECASE)
+_AVAIL_RE = re.compile(r"not available|busy", re.IGNORECASE)
+_SPECIFIC_RE = re.compile(r"language|prefer|favorite", re.IGNORECASE)
+# Pattern sources starting with one of the _SPECIFIC_RE words
+_SPECIFIC_PREFIX_RE = re.compile(r"language|prefer|favorite")
+
+
+def _compile_all(patterns: List[str]) -> List[re.Pattern]:
+    """Compile case-insensitive extraction patterns"""
+    return [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+
+
+def _fuse(patterns: List[re.Pattern]) -> re.Pattern:
+    """
+    Combine patterns into one alternation that matches iff any of them does
+    
+    Used as a gate: one failed scan rules out the whole group. The patterns
+    still run individually on a hit, because their matches may overlap and
+    a single alternation would report only one of them.
+    """
+    return re.compile("|".join(f"(?:{p.pattern})" for p in patterns), re.IGNORECASE)
+
+
+def _has_trigger(folded: str, triggers: tuple) -> bool:
+    """Check a casefolded message for any of a group's trigger literals"""
+    for trigger in triggers:
+        if trigger in folded:
+            return True
+    return False
+
+
+def _match_value(match: re.Match, content: str):
+    """The first capture group of a match, or its whole content if it has none"""
+    return match.group(1) if match.groups() else content
+
+
+def _fixed_key(key: str):
+    """Key-value builder using the same key for every match of a group"""
+    def key_value(content: str, match: re.Match) -> tuple:
+        return key, _match_value(match, content)
+    return key_value
+
+
+# Matches whenever either fact pattern could
+_FACT_GATE = _compile_linear(r"\s(?:is|are|was|were)\s|my\s")
+
+
 class MemoryExtractor:
     """Extracts and classifies important information from conversation turns"""
     
     def __init__(self):
-        # Patterns for identifying different memory types
-        self.preference_patterns = [
+        # Patterns for identifying different memory types, compiled once
+        self.preference_patterns = _compile_all([
             r"prefer[s]?\s+(.+)",
             r"like[s]?\s+(.+)",
             r"favorite\s+(.+)",
             r"my\s+(.+)\s+is\s+(.+)",
             r"call me\s+(.+)",
             r"language\s+is\s+(\w+)",
-        ]
+        ])
         
-        self.constraint_patterns = [
+        self.constraint_patterns = _compile_all([
             r"(?:only|must|should|need to)\s+(.+)",
             r"(?:before|after|by)\s+(\d+(?::\d+)?(?:\s*(?:AM|PM|am|pm))?)",
             r"(?:not available|busy|occupied)\s+(.+)",
             r"(?:don't|do not|never)\s+(.+)",
-        ]
+        ])
         
-        self.commitment_patterns = [
+        self.commitment_patterns = _compile_all([
             r"(?:will|going to|planning to)\s+(.+)",
             r"(?:call|email|text|message|contact)\s+(.+)",
             r"(?:remind me|schedule|set up)\s+(.+)",
             r"(?:tomorrow|next week|later|soon)\s+(.+)?",
-        ]
+        ])
         
-        self.instruction_patterns = [
+        self.instruction_patterns = _compile_all([
             r"(?:always|never|from now on)\s+(.+)",
             r"(?:remember to|make sure to)\s+(.+)",
             r"(?:whenever|if)\s+(.+)",
+        ])
+        
+        # Most messages match few of the groups, so each group is gated
+        # behind a single scan of its fused patterns
+        self._preference_gate = _fuse(self.preference_patterns)
+        self._constraint_gate = _fuse(self.constraint_patterns)
+        self._commitment_gate = _fuse(self.commitment_patterns)
+        self._instruction_gate = _fuse(self.instruction_patterns)
+        
+        # Every pattern in a group starts with one of these literals, so a
+        # message containing none of them can skip the group's regexes
+        self._preference_triggers = (
+            "prefer", "like", "favorite", "my", "call me", "language",
+        )
+        self._constraint_triggers = (
+            "only", "must", "should", "need to", "before", "after", "by",
+            "not available", "busy", "occupied", "don't", "do not", "never",
+        )
+        self._commitment_triggers = (
+            "will", "going to", "planning to", "call", "email", "text",
+            "message", "contact", "remind me", "schedule", "set up",
+            "tomorrow", "next week", "later", "soon",
+        )
+        self._instruction_triggers = (
+            "always", "never", "from now on", "remember to", "make sure to",
+            "whenever", "if",
+        )
+        self._fact_triggers = ("is", "are", "was", "were", "my")
+        
+        # Patterns whose every match contains a specific word, so their
+        # confidence boost needs no scan of the matched content
+        self._specific_patterns = frozenset(
+            pattern
+            for group in (self.preference_patterns, self.constraint_patterns,
+                          self.commitment_patterns, self.instruction_patterns)
+            for pattern in group
+            if _SPECIFIC_PREFIX_RE.match(pattern.pattern)
+        )
+        
+        # Pattern groups in extraction order, with how each match becomes
+        # a memory: (triggers, gate, patterns, memory type, key/value builder)
+        self._pattern_groups = [
+            (self._preference_triggers, self._preference_gate, self.preference_patterns,
+             MemoryType.PREFERENCE.value, self._preference_key_value),
+            (self._constraint_triggers, self._constraint_gate, self.constraint_patterns,
+             MemoryType.CONSTRAINT.value, self._constraint_key_value),
+            (self._commitment_triggers, self._commitment_gate, self.commitment_patterns,
+             MemoryType.COMMITMENT.value, _fixed_key("scheduled_action")),
+            (self._instruction_triggers, self._instruction_gate, self.instruction_patterns,
+             MemoryType.INSTRUCTION.value, _fixed_key("instruction")),
         ]
+        
+        # Per-instance cache so repeated messages (retries, echoes) skip the
+        # regex work; only the message text affects what is extracted
+        self._extract_from_text = lru_cache(maxsize=4096)(self._extract_from_text_uncached)
     
     def extract_memories(
         self, 
@@ -73,163 +249,128 @@ class MemoryExtractor:
         Returns:
             List of extracted memory objects
         """
+        # Build fresh dicts from the cached entries, with per-turn metadata
+        now_iso = datetime.now(timezone.utc).isoformat()
+        return [
+            memory.to_dict(session_id, turn_number, now_iso)
+            for memory in self._extract_from_text(user_message)
+        ]
+    
+    def _extract_from_text_uncached(self, user_message: str) -> Tuple[ExtractedMemory, ...]:
+        """Run every extraction pattern group over a message"""
         memories = []
         
-        # Extract from user message
-        memories.extend(self._extract_preferences(user_message, turn_number))
-        memories.extend(self._extract_constraints(user_message, turn_number))
-        memories.extend(self._extract_commitments(user_message, turn_number))
-        memories.extend(self._extract_instructions(user_message, turn_number))
-        memories.extend(self._extract_entities(user_message, turn_number))
-        memories.extend(self._extract_facts(user_message, turn_number))
+        # Lowercase once for the trigger prefilter. casefold() also maps the
+        # long s and Kelvin sign the way IGNORECASE matching does; the
+        # dotless i is the one fold it misses
+        folded = user_message.casefold().replace("\u0131", "i")
         
-        # Add metadata to all memories
-        for memory in memories:
-            memory["session_id"] = session_id
-            memory["source_turn"] = turn_number
-            memory["created_at"] = datetime.utcnow().isoformat()
-            memory["last_accessed"] = None
-            memory["access_count"] = 0
+        # Extract from user message
+        for triggers, gate, patterns, memory_type, key_value in self._pattern_groups:
+            if _has_trigger(folded, triggers):
+                memories.extend(
+                    self._extract_by_patterns(user_message, gate, patterns, memory_type, key_value)
+                )
+        memories.extend(self._extract_entities(user_message))
+        if _has_trigger(folded, self._fact_triggers):
+            memories.extend(self._extract_facts(user_message))
         
-        return memories
+        return tuple(memories)
     
-    def _extract_preferences(self, text: str, turn_number: int) -> List[Dict[str, Any]]:
-        """Extract user preferences"""
-        memories = []
-        
-        for pattern in self.preference_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                content = match.group(0)
-                
-                # Extract key-value if possible
-                key, value = self._parse_preference(content)
-                
-                memory = {
-                    "type": MemoryType.PREFERENCE.value,
-                    "content": content,
-                    "key": key,
-                    "value": value,
-                    "confidence": self._calculate_confidence(content, pattern),
-                    "raw_text": text
-                }
-                memories.append(memory)
+    def _extract_by_patterns(
+        self,
+        text: str,
+        gate: re.Pattern,
+        patterns: List[re.Pattern],
+        memory_type: str,
+        key_value
+    ) -> List[ExtractedMemory]:
+        """
+        Extract one memory per match of a pattern group
         
-        return memories
-    
-    def _extract_constraints(self, text: str, turn_number: int) -> List[Dict[str, Any]]:
-        """Extract constraints and limitations"""
+        Args:
+            text: Message to extract from
+            gate: Fused group pattern, ruling the group out in one scan
+            patterns: The group's patterns, in order
+            memory_type: MemoryType value for the group
+            key_value: Builds the (key, value) pair from the content and match
+        """
         memories = []
+        if gate.search(text) is None:
+            return memories
         
-        for pattern in self.constraint_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
+        for pattern in patterns:
+            matches = pattern.finditer(text)
             for match in matches:
                 content = match.group(0)
+                key, value = key_value(content, match)
                 
-                memory = {
-                    "type": MemoryType.CONSTRAINT.value,
-                    "content": content,
-                    "key": self._extract_constraint_key(content),
-                    "value": match.group(1) if match.groups() else content,
-                    "confidence": self._calculate_confidence(content, pattern),
-                    "raw_text": text
-                }
+                memory = ExtractedMemory(
+                    type=memory_type,
+                    content=content,
+                    key=key,
+                    value=value,
+                    confidence=self._calculate_confidence(content, pattern),
+                    raw_text=text
+                )
                 memories.append(memory)
         
         return memories
     
-    def _extract_commitments(self, text: str, turn_number: int) -> List[Dict[str, Any]]:
-        """Extract commitments and scheduled actions"""
-        memories = []
-        
-        for pattern in self.commitment_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                content = match.group(0)
-                
-                memory = {
-                    "type": MemoryType.COMMITMENT.value,
-                    "content": content,
-                    "key": "scheduled_action",
-                    "value": match.group(1) if match.groups() else content,
-                    "confidence": self._calculate_confidence(content, pattern),
-                    "raw_text": text
-                }
-                memories.append(memory)
-        
-        return memories
+    def _preference_key_value(self, content: str, match: re.Match) -> tuple:
+        """Key-value pair of a preference, parsed from its content"""
+        return self._parse_preference(content)
     
-    def _extract_instructions(self, text: str, turn_number: int) -> List[Dict[str, Any]]:
-        """Extract long-term instructions"""
-        memories = []
-        
-        for pattern in self.instruction_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                content = match.group(0)
-                
-                memory = {
-                    "type": MemoryType.INSTRUCTION.value,
-                    "content": content,
-                    "key": "instruction",
-                    "value": match.group(1) if match.groups() else content,
-                    "confidence": self._calculate_confidence(content, pattern),
-                    "raw_text": text
-                }
-                memories.append(memory)
-        
-        return memories
+    def _constraint_key_value(self, content: str, match: re.Match) -> tuple:
+        """Constraint type as the key, the captured detail as the value"""
+        return self._extract_constraint_key(content), _match_value(match, content)
     
-    def _extract_entities(self, text: str, turn_number: int) -> List[Dict[str, Any]]:
+    def _extract_entities(self, text: str) -> List[ExtractedMemory]:
         """Extract named entities (simplified - can be enhanced with NER)"""
         memories = []
         
         # Simple entity extraction - names, places, organizations
         # Look for capitalized sequences
-        entity_pattern = r'\b([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\b'
-        matches = re.finditer(entity_pattern, text)
+        matches = _ENTITY_RE.finditer(text)
         
         for match in matches:
             entity = match.group(1)
             # Filter out common words
-            if entity.lower() not in ['i', 'my', 'the', 'a', 'an']:
-                memory = {
-                    "type": MemoryType.ENTITY.value,
-                    "content": entity,
-                    "key": "entity_name",
-                    "value": entity,
-                    "confidence": 0.7,
-                    "raw_text": text
-                }
+            if entity not in _TITLECASE_STOPS:
+                memory = ExtractedMemory(
+                    type=MemoryType.ENTITY.value,
+                    content=entity,
+                    key="entity_name",
+                    value=entity,
+                    confidence=0.7,
+                    raw_text=text
+                )
                 memories.append(memory)
         
         return memories
     
-    def _extract_facts(self, text: str, turn_number: int) -> List[Dict[str, Any]]:
+    def _extract_facts(self, text: str) -> List[ExtractedMemory]:
         """Extract factual statements"""
         memories = []
         
-        # Look for "is", "are", "was", "were" patterns
-        fact_patterns = [
-            r"(.+)\s+(?:is|are|was|were)\s+(.+)",
-            r"my\s+(.+)",
-        ]
+        if _FACT_GATE.search(text) is None:
+            return memories
         
-        for pattern in fact_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
+        # Look for "is", "are", "was", "were" and "my" patterns
+        for pattern in (_FACT_RE, _MY_RE):
+            for match in pattern.finditer(text):
                 content = match.group(0)
                 
                 # Avoid duplicating other memory types
                 if len(content) > 10 and len(content.split()) > 2:
-                    memory = {
-                        "type": MemoryType.FACT.value,
-                        "content": content,
-                        "key": "fact",
-                        "value": content,
-                        "confidence": 0.6,
-                        "raw_text": text
-                    }
+                    memory = ExtractedMemory(
+                        type=MemoryType.FACT.value,
+                        content=content,
+                        key="fact",
+                        value=content,
+                        confidence=0.6,
+                        raw_text=text
+                    )
                     memories.append(memory)
         
         return memories
@@ -237,15 +378,8 @@ class MemoryExtractor:
     def _parse_preference(self, text: str) -> tuple:
         """Parse preference into key-value pair"""
         # Try to extract structured preference
-        patterns = [
-            (r"language\s+is\s+(\w+)", ("language", 1)),
-            (r"prefer[s]?\s+(.+)", ("preference", 1)),
-            (r"favorite\s+(.+)", ("favorite", 1)),
-            (r"call me\s+(.+)", ("name", 1)),
-        ]
-        
-        for pattern, (key, group) in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern, (key, group) in _PREFERENCE_KEY_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return key, match.group(group)
         
@@ -253,14 +387,14 @@ class MemoryExtractor:
     
     def _extract_constraint_key(self, text: str) -> str:
         """Extract constraint type"""
-        if re.search(r"time|am|pm|\d+:\d+", text, re.IGNORECASE):
+        if _TIME_RE.search(text):
             return "time_constraint"
-        elif re.search(r"not available|busy", text, re.IGNORECASE):
+        elif _AVAIL_RE.search(text):
             return "availability"
         else:
             return "general_constraint"
     
-    def _calculate_confidence(self, content: str, pattern: str) -> float:
+    def _calculate_confidence(self, content: str, pattern: re.Pattern) -> float:
         """
         Calculate confidence score for extracted memory
         Higher confidence for more specific patterns
@@ -272,7 +406,7 @@ class MemoryExtractor:
             base_confidence -= 0.2
         
         # Boost confidence for specific patterns
-        if re.search(r"language|prefer|favorite", content, re.IGNORECASE):
+        if pattern in self._specific_patterns or _SPECIFIC_RE.search(content):
             base_confidence += 0.1
         
         return min(0.99, max(0.5, base_confidence))
@@ -292,7 +426,7 @@ class MemoryExtractor:
         
         for memory in memories:
             # Create a simple fingerprint
-            fingerprint = f"{memory['type']}:{memory['key']}:{memory['value']}"
+            fingerprint = (memory['type'], memory['key'], memory['value'])
             
             if fingerprint not in seen:
                 seen.add(fingerprint)
@@ -3,10 +3,84 @@ Memory Retrieval Module
 Retrieves relevant memories based on context, recency, and importance
 """
 
+import heapq
 import math
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
-from collections import defaultdict
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from memory_storage import SessionBlock
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Common stopwords ignored by keyword similarity
+_STOPWORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'is', 'are'})
+
+
+def _tokenize(text: str) -> frozenset:
+    """Lowercased, stopword-free words of a text"""
+    return frozenset(text.lower().split()) - _STOPWORDS
+
+
+@lru_cache(maxsize=8192)
+def _keyword_set(text: str) -> frozenset:
+    """
+    Cached _tokenize for memory contents
+    
+    Memory contents come back from storage on every retrieval, so caching
+    by content string means each one is only tokenized once. Queries are
+    mostly one-off and go through _tokenize directly, so long messages
+    don't push contents out of the cache.
+    """
+    return _tokenize(text)
+
+
+def _jaccard(memory_words: frozenset, query_words: frozenset) -> float:
+    """Jaccard similarity of two keyword sets (0.0 if either is empty)"""
+    if not memory_words or not query_words:
+        return 0.0
+    
+    intersection = len(memory_words & query_words)
+    return intersection / (len(memory_words) + len(query_words) - intersection)
+
+
+def _score_all_numpy(
+    static_scores: np.ndarray,
+    semantic_scores: np.ndarray,
+    type_scores: np.ndarray,
+    semantic_weight: float
+) -> np.ndarray:
+    """Final relevance of each memory, capped at 1.0"""
+    return np.minimum(1.0, (static_scores + semantic_weight * semantic_scores) * type_scores)
+
+
+# Sessions with fewer memories are scored with NumPy: below this size,
+# starting numba's thread pool costs more than the expression it replaces
+NUMBA_MIN_MEMORIES = 10_000
+
+if numba is not None:
+    # No fastmath, so the arithmetic (and near-tie rankings) match NumPy's
+    @numba.njit(cache=True, parallel=True)
+    def _score_all_numba(static_scores, semantic_scores, type_scores, semantic_weight):
+        out = np.empty(static_scores.shape[0])
+        for i in numba.prange(static_scores.shape[0]):
+            out[i] = min(1.0, (static_scores[i] + semantic_weight * semantic_scores[i]) * type_scores[i])
+        return out
+    
+    def _score_all(static_scores, semantic_scores, type_scores, semantic_weight):
+        """Final relevance of each memory, compiled for very large sessions"""
+        if static_scores.shape[0] < NUMBA_MIN_MEMORIES:
+            return _score_all_numpy(static_scores, semantic_scores, type_scores, semantic_weight)
+        return _score_all_numba(static_scores, semantic_scores, type_scores, semantic_weight)
+else:
+    _score_all = _score_all_numpy
 
 
 class MemoryRetriever:
@@ -58,111 +132,191 @@ class MemoryRetriever:
         Returns:
             List of relevant memories with relevance scores
         """
-        # Get all session memories
-        all_memories = self.storage.get_session_memories(session_id)
+        return self.retrieve_relevant_memories_batch(
+            session_id=session_id,
+            current_turn=current_turn,
+            user_messages=[user_message],
+            max_memories=max_memories,
+            min_relevance=min_relevance
+        )[0]
+    
+    def retrieve_relevant_memories_batch(
+        self,
+        session_id: str,
+        current_turn: int,
+        user_messages: List[str],
+        max_memories: int = 5,
+        min_relevance: float = 0.3
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve relevant memories for several messages at once
         
-        if not all_memories:
-            return []
+        Session memories are loaded once and ranked against every message.
+        All messages are scored against the same access counts; the
+        access updates from this call are applied afterwards.
         
+        Args:
+            session_id: Current session
+            current_turn: Current turn number
+            user_messages: Messages to retrieve memories for
+            max_memories: Maximum memories to return per message
+            min_relevance: Minimum relevance score threshold
+            
+        Returns:
+            One list of relevant memories per message, in input order
+        """
+        # Get all session memories as columns; dicts are only built for
+        # the memories that get returned
+        block = self.storage.get_session_block(session_id)
+        
+        if block is None:
+            return [[] for _ in user_messages]
+        
+        # Everything but semantic similarity is the same for every message
+        static_scores, type_scores = self._calculate_static_relevance(block, current_turn)
+        
+        results = [
+            self._rank_memories(
+                block, static_scores, type_scores, _tokenize(user_message), max_memories, min_relevance
+            )
+            for user_message in user_messages
+        ]
+        
+        # Update access statistics
+        self.storage.update_memory_access_bulk(
+            [memory["id"] for memories in results for memory in memories]
+        )
+        
+        return results
+    
+    def _rank_memories(
+        self,
+        block: SessionBlock,
+        static_scores: np.ndarray,
+        type_scores: np.ndarray,
+        query_words: frozenset,
+        max_memories: int,
+        min_relevance: float
+    ) -> List[Dict[str, Any]]:
+        """Score, sort and diversity-filter memories for one tokenized message"""
         # Calculate relevance for each memory
-        scored_memories = []
-        for memory in all_memories:
-            relevance_score = self._calculate_relevance(
-                memory, 
-                current_turn, 
-                user_message
+        semantic_scores = self._calculate_semantic_similarities(block.contents, query_words)
+        scores = _score_all(static_scores, semantic_scores, type_scores, self.semantic_weight)
+        
+        candidates = np.flatnonzero(scores >= min_relevance)
+        
+        # The diversity pass usually fills up from the best few candidates.
+        # If it does, that's exactly what it would pick from the full sorted
+        # list, so only fall back to sorting everything when it doesn't
+        headroom = max_memories * 3
+        if len(candidates) > headroom:
+            head = self._top_candidates(candidates, scores, headroom)
+            diverse_memories = self._select_diverse(
+                self._with_scores(block, scores, head),
+                max_memories
             )
-            
-            if relevance_score >= min_relevance:
-                memory_copy = memory.copy()
-                memory_copy["relevance_score"] = relevance_score
-                scored_memories.append(memory_copy)
+            if len(diverse_memories) >= max_memories:
+                return diverse_memories
         
-        # Sort by relevance
-        scored_memories.sort(key=lambda x: x["relevance_score"], reverse=True)
+        # Sort by relevance (stable, so ties keep storage order)
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
         
         # Apply diversity filtering
         diverse_memories = self._apply_diversity_filter(
-            scored_memories, 
+            self._with_scores(block, scores, order),
             max_memories
         )
         
-        # Update access statistics
-        for memory in diverse_memories:
-            self.storage.update_memory_access(memory["id"])
-        
         return diverse_memories[:max_memories]
     
-    def _calculate_relevance(
-        self, 
-        memory: Dict[str, Any], 
-        current_turn: int, 
-        user_message: str
-    ) -> float:
+    def _top_candidates(self, candidates: np.ndarray, scores: np.ndarray, count: int) -> np.ndarray:
         """
-        Calculate relevance score for a memory
+        The `count` best candidates in ranking order, without a full sort
+        
+        Matches the first `count` entries of the stable descending sort:
+        everything above the cut-off score, then ties at it in storage order.
+        """
+        candidate_scores = scores[candidates]
+        cutoff = np.partition(candidate_scores, len(candidates) - count)[len(candidates) - count]
+        
+        above = candidates[candidate_scores > cutoff]
+        tied = candidates[candidate_scores == cutoff][:count - len(above)]
+        head = np.concatenate([above, tied])
+        
+        return head[np.argsort(-scores[head], kind="stable")]
+    
+    def _with_scores(
+        self,
+        block: SessionBlock,
+        scores: np.ndarray,
+        order: np.ndarray
+    ) -> List[Dict[str, Any]]:
+        """Build the memories at `order`, annotated with their relevance scores"""
+        scored_memories = []
+        for index in order:
+            memory = block.memory(index)
+            memory["relevance_score"] = float(scores[index])
+            scored_memories.append(memory)
+        return scored_memories
+    
+    def _calculate_static_relevance(
+        self,
+        block: SessionBlock,
+        current_turn: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculate the message-independent part of each memory's relevance
         
         Combines multiple signals:
         - Recency (how recent is the memory)
         - Confidence (how confident we are in the memory)
         - Access count (how often has it been used)
-        - Semantic similarity (how related to current message)
         - Type priority (importance of memory type)
+        
+        Semantic similarity is added per message in _rank_memories.
+        
+        Returns:
+            Weighted recency + confidence + access sum, and the type
+            priority multiplier, both aligned with the block's rows
         """
-        # 1. Recency score (exponential decay)
-        turn_distance = current_turn - memory.get("source_turn", 0)
-        recency_score = math.exp(-turn_distance / 100)  # Decay over ~100 turns
-        
-        # 2. Confidence score
-        confidence_score = memory.get("confidence", 0.5)
-        
-        # 3. Access count score (logarithmic scaling)
-        access_count = memory.get("access_count", 0)
-        access_score = math.log(access_count + 1) / math.log(10)  # Normalize to 0-1
-        access_score = min(1.0, access_score)
-        
-        # 4. Semantic similarity score
-        semantic_score = self._calculate_semantic_similarity(
-            memory.get("content", ""),
-            user_message
+        type_priorities = self.type_priorities
+        type_scores = np.fromiter(
+            (type_priorities.get(memory_type, 0.5) for memory_type in block.types),
+            dtype=np.float64,
+            count=len(block.types)
         )
         
-        # 5. Type priority score
-        memory_type = memory.get("type", "fact")
-        type_score = self.type_priorities.get(memory_type, 0.5)
+        # 1. Recency score (exponential decay over ~100 turns)
+        recency_scores = np.exp(-(current_turn - block.source_turns) / 100)
+        
+        # 2. Access count score (logarithmic scaling, normalized to 0-1)
+        access_scores = np.minimum(1.0, np.log(block.access_counts + 1) / math.log(10))
         
-        # Combine scores with weights
-        total_score = (
-            self.recency_weight * recency_score +
-            self.confidence_weight * confidence_score +
-            self.access_count_weight * access_score +
-            self.semantic_weight * semantic_score
-        ) * type_score
+        static_scores = (
+            self.recency_weight * recency_scores +
+            self.confidence_weight * block.confidences +
+            self.access_count_weight * access_scores
+        )
         
-        return min(1.0, total_score)
+        return static_scores, type_scores
+    
+    def _calculate_semantic_similarities(self, contents: List[str], query_words: frozenset) -> np.ndarray:
+        """Semantic similarity of each memory content to the query's keyword set"""
+        if not query_words:
+            return np.zeros(len(contents))
+        
+        return np.fromiter(
+            (_jaccard(_keyword_set(content), query_words) for content in contents),
+            dtype=np.float64,
+            count=len(contents)
+        )
     
     def _calculate_semantic_similarity(self, memory_content: str, query: str) -> float:
         """
         Calculate semantic similarity between memory and query
         Uses simple keyword matching (can be enhanced with embeddings)
         """
-        # Convert to lowercase and split into words
-        memory_words = set(memory_content.lower().split())
-        query_words = set(query.lower().split())
-        
-        # Remove common stopwords
-        stopwords = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'is', 'are'}
-        memory_words -= stopwords
-        query_words -= stopwords
-        
-        if not memory_words or not query_words:
-            return 0.0
-        
-        # Calculate Jaccard similarity
-        intersection = len(memory_words & query_words)
-        union = len(memory_words | query_words)
-        
-        return intersection / union if union > 0 else 0.0
+        return _jaccard(_keyword_set(memory_content), _tokenize(query))
     
     def _apply_diversity_filter(
         self, 
@@ -176,6 +330,27 @@ class MemoryRetriever:
         if len(memories) <= max_count:
             return memories
         
+        diverse_memories = self._select_diverse(memories, max_count)
+        
+        # Fill remaining slots with highest-scoring memories
+        if len(diverse_memories) < max_count:
+            for memory in memories:
+                if memory not in diverse_memories:
+                    diverse_memories.append(memory)
+                    if len(diverse_memories) >= max_count:
+                        break
+        
+        return diverse_memories
+    
+    def _select_diverse(
+        self,
+        memories: List[Dict[str, Any]],
+        max_count: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Walk memories in ranking order, keeping at most 2 per type and
+        avoiding repeated keys once half the slots are used
+        """
         diverse_memories = []
         type_counts = defaultdict(int)
         seen_keys = set()
@@ -195,14 +370,6 @@ class MemoryRetriever:
                     if len(diverse_memories) >= max_count:
                         break
         
-        # Fill remaining slots with highest-scoring memories
-        if len(diverse_memories) < max_count:
-            for memory in memories:
-                if memory not in diverse_memories:
-                    diverse_memories.append(memory)
-                    if len(diverse_memories) >= max_count:
-                        break
-        
         return diverse_memories
     
     def retrieve_by_type(
@@ -217,13 +384,12 @@ class MemoryRetriever:
             memory_type=memory_type
         )
         
-        # Sort by confidence and recency
-        memories.sort(
-            key=lambda x: (x.get("confidence", 0), -x.get("source_turn", 0)),
-            reverse=True
+        # Top by confidence, then recency (same result as a full sort + slice)
+        return heapq.nlargest(
+            max_memories,
+            memories,
+            key=lambda x: (x.get("confidence", 0), -x.get("source_turn", 0))
         )
-        
-        return memories[:max_memories]
     
     def retrieve_by_turn_range(
         self,
@@ -232,14 +398,12 @@ class MemoryRetriever:
         end_turn: int
     ) -> List[Dict[str, Any]]:
         """Retrieve memories from a specific turn range"""
-        all_memories = self.storage.get_session_memories(session_id)
-        
-        filtered = [
-            m for m in all_memories 
-            if start_turn <= m.get("source_turn", 0) <= end_turn
-        ]
-        
-        return filtered
+        # Range-filtered in SQL over the (session_id, source_turn) index
+        return self.storage.get_session_memories(
+            session_id,
+            start_turn=start_turn,
+            end_turn=end_turn
+        )
     
     def retrieve_critical_memories(
         self,
@@ -284,46 +448,46 @@ class MemoryRetriever:
         
         formatted = ["## Active Memories"]
         
-        # Group by type
-        by_type = defaultdict(list)
+        # Group by type, in type priority order; other types follow in
+        # order of first appearance
+        by_type: Dict[str, List[Dict[str, Any]]] = {mem_type: [] for mem_type in self.type_priorities}
         for memory in memories:
-            by_type[memory.get("type", "other")].append(memory)
+            mem_type = memory.get("type", "other")
+            bucket = by_type.get(mem_type)
+            if bucket is None:
+                bucket = by_type[mem_type] = []
+            bucket.append(memory)
         
         for mem_type, mems in by_type.items():
+            if not mems:
+                continue
             formatted.append(f"\n### {mem_type.title()}s:")
-            for mem in mems:
-                content = mem.get("content", "")
-                
-                if include_metadata:
-                    turn = mem.get("source_turn", 0)
-                    conf = mem.get("confidence", 0)
-                    formatted.append(f"- {content} (from turn {turn}, confidence: {conf:.2f})")
-                else:
-                    formatted.append(f"- {content}")
+            if include_metadata:
+                formatted.extend(
+                    f"- {mem.get('content', '')} (from turn {mem.get('source_turn', 0)}, "
+                    f"confidence: {mem.get('confidence', 0):.2f})"
+                    for mem in mems
+                )
+            else:
+                formatted.extend(f"- {mem.get('content', '')}" for mem in mems)
         
         return "\n".join(formatted)
     
     def get_retrieval_stats(self, session_id: str) -> Dict[str, Any]:
         """Get statistics about memory retrieval for a session"""
-        all_memories = self.storage.get_session_memories(session_id)
+        block = self.storage.get_session_block(session_id)
         
-        if not all_memories:
+        if block is None:
             return {"total_memories": 0}
         
-        # Calculate stats
-        total_accesses = sum(m.get("access_count", 0) for m in all_memories)
-        avg_confidence = sum(m.get("confidence", 0) for m in all_memories) / len(all_memories)
-        
-        type_distribution = defaultdict(int)
-        for mem in all_memories:
-            type_distribution[mem.get("type", "unknown")] += 1
-        
+        # Aggregate over the block's columns; argmax picks the first of
+        # equally accessed memories
         return {
-            "total_memories": len(all_memories),
-            "total_accesses": total_accesses,
-            "avg_confidence": avg_confidence,
-            "type_distribution": dict(type_distribution),
-            "most_accessed": max(all_memories, key=lambda x: x.get("access_count", 0))
+            "total_memories": len(block.rows),
+            "total_accesses": int(block.access_counts.sum()),
+            "avg_confidence": float(block.confidences.mean()),
+            "type_distribution": dict(Counter(block.types)),
+            "most_accessed": block.memory(int(np.argmax(block.access_counts)))
         }
 
 
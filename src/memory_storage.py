@@ -7,9 +7,12 @@ import sqlite3
 import json
 import numpy as np
 from typing import List, Dict, Any, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+from collections import Counter, OrderedDict, namedtuple
 import os
 import pickle
+import threading
+import weakref
 
 # Global flag for vector search availability
 VECTOR_SEARCH_AVAILABLE = False
@@ -22,26 +25,161 @@ except ImportError:
     print("Warning: FAISS or sentence-transformers not available. Vector search disabled.")
     print("The system will work with text-based search fallback.")
 
+# Sentence transformer used for embeddings. Smaller models such as
+# "paraphrase-MiniLM-L3-v2" (3 layers, same 384 dimensions) encode faster
+# at a small cost in retrieval quality.
+DEFAULT_EMBEDDING_MODEL = os.environ.get("MEMORY_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Inference backend for the sentence transformer: "torch", or "onnx" /
+# "openvino" (sentence-transformers 3.2+ with the matching extra), which
+# run an optimized - optionally int8-quantized - export of the model on CPU
+DEFAULT_EMBEDDING_BACKEND = os.environ.get("MEMORY_EMBEDDING_BACKEND", "torch")
+
+# OpenMP threads FAISS may use per search. Batched searches spread their
+# queries across these; lower it when many request threads search at once.
+FAISS_THREADS = int(os.environ.get("MEMORY_FAISS_THREADS", os.cpu_count() or 1))
+
+# Search on a GPU copy of the index when faiss-gpu sees a device; set to
+# "0" to keep searches on the CPU
+FAISS_USE_GPU = os.environ.get("MEMORY_FAISS_GPU", "1") != "0"
+
+# Embeddings kept for recently encoded texts, and the longest text cached
+# (long texts rarely repeat and would crowd out the short ones that do)
+EMBEDDING_CACHE_SIZE = 4096
+MAX_CACHED_TEXT_LENGTH = 512
+
+# Position -> memory ID map written by older versions next to the index
+LEGACY_ID_MAP_NAME = "id_map.pkl"
+
+# Loaded sentence transformers keyed by (model, backend), shared by every
+# MemoryStorage in the process so each model is loaded from disk only once
+_encoders: Dict[Any, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+class _ThreadConnection:
+    """Holds one thread's SQLite connection and closes it once dropped"""
+    
+    __slots__ = ("conn", "__weakref__")
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        weakref.finalize(self, conn.close)
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    """Convert SQLite row to dictionary"""
+    return {
+        "id": row[0],
+        "session_id": row[1],
+        "type": row[2],
+        "content": row[3],
+        "key": row[4],
+        "value": row[5],
+        "confidence": row[6],
+        "source_turn": row[7],
+        "created_at": row[8],
+        "last_accessed": row[9],
+        "access_count": row[10],
+        "raw_text": row[11]
+    }
+
+
+class SessionBlock(namedtuple(
+    "SessionBlock", "rows ids source_turns confidences access_counts types contents"
+)):
+    """
+    A session's memories as parallel columns, ordered by source turn
+    
+    The numeric columns are NumPy arrays so relevance can be scored
+    without a dict per memory; memory() builds the dict for one row.
+    """
+    __slots__ = ()
+    
+    def memory(self, index: int) -> Dict[str, Any]:
+        """Full memory dictionary for the row at `index`"""
+        return _row_to_dict(self.rows[index])
+
 
 class MemoryStorage:
     """Hybrid storage system using SQLite and FAISS"""
     
-    def __init__(self, db_path: str = "data/memories.db", embedding_model: str = "all-MiniLM-L6-v2"):
+    # FAISS index layouts for new stores
+    INDEX_TYPES = ("flat", "hnsw", "ivf", "sqfp16")
+    
+    def __init__(
+        self,
+        db_path: str = "data/memories.db",
+        embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+        embedding_backend: str = DEFAULT_EMBEDDING_BACKEND,
+        index_type: str = "flat",
+        ivf_nlist: int = 256,
+        nprobe: int = 8
+    ):
         """
         Initialize storage system
         
         Args:
-            db_path: Path to SQLite database
+            db_path: Path to SQLite database, or ":memory:" for a throwaway
+                store; each thread's connection then gets its own empty
+                database, so that is only suitable for single-threaded use
             embedding_model: Sentence transformer model for embeddings
+            embedding_backend: "torch", "onnx" or "openvino"; falls back to
+                torch if the backend can't be loaded
+            index_type: FAISS index for new stores - "flat" (exact, scans
+                every vector), "hnsw" (approximate, sub-linear search) or
+                "ivf" (approximate, 8-bit quantized vectors; exact flat
+                search until there are enough vectors to train it) or
+                "sqfp16" (exhaustive like "flat", half the memory)
+            ivf_nlist: Number of IVF clusters
+            nprobe: Number of IVF clusters scanned per query
         """
         global VECTOR_SEARCH_AVAILABLE
         
+        if index_type not in self.INDEX_TYPES:
+            raise ValueError(f"index_type must be one of {self.INDEX_TYPES}, got {index_type!r}")
+        
         self.db_path = db_path
-        self.embedding_dim = 384  # Dimension for all-MiniLM-L6-v2
+        # The vector index lives in embeddings/ beside the database, so
+        # every database has its own; in-memory stores don't persist it
+        if db_path == ":memory:":
+            self.index_dir = None
+        else:
+            self.index_dir = os.path.join(os.path.dirname(db_path) or "data", "embeddings")
+        self.index_type = index_type
+        self.ivf_nlist = ivf_nlist
+        self.nprobe = nprobe
+        self.embedding_dim = 384  # Dimension for the MiniLM family
         self.vector_search_enabled = False
         
+        # GPU replica of self.index used for searches; self.index stays on
+        # the CPU and is what gets persisted
+        self._gpu_resources = None
+        self._gpu_index = None
+        
+        # Guards the FAISS index and id map, which may be written from a
+        # background storage thread while other threads search
+        self._index_lock = threading.RLock()
+        
+        # One SQLite connection per thread, reused across calls. Writes are
+        # serialized so concurrent writers never hit SQLITE_BUSY. Only the
+        # thread-local holds a connection strongly, so it is closed as soon
+        # as its thread exits; the weak set lets close() reach the live ones.
+        self._local = threading.local()
+        self._connections: "weakref.WeakSet[_ThreadConnection]" = weakref.WeakSet()
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        
+        # Writing the index rewrites the whole file, so additions only mark
+        # it dirty; it is saved at most once per index_save_delay seconds
+        # and on flush()/close()
+        self.index_save_delay = 30.0
+        self._index_dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        
         # Create data directory if it doesn't exist
-        os.makedirs(os.path.dirname(db_path) if os.path.dirname(db_path) else "data", exist_ok=True)
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path) or "data", exist_ok=True)
         
         # Initialize SQLite database
         self._init_database()
@@ -49,19 +187,76 @@ class MemoryStorage:
         # Initialize vector search if available
         if VECTOR_SEARCH_AVAILABLE:
             try:
-                self.encoder = SentenceTransformer(embedding_model)
+                self.encoder = self._load_encoder(embedding_model, embedding_backend)
                 self.embedding_dim = self.encoder.get_sentence_embedding_dimension()
+                faiss.omp_set_num_threads(FAISS_THREADS)
                 self.index = self._load_or_create_index()
-                self.memory_id_map = self._load_or_create_id_map()
+                self._refresh_gpu_index()
+                # Per-instance LRU cache so repeated contents and queries
+                # skip the encoder
+                self._embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+                self._embedding_cache_lock = threading.Lock()
                 self.vector_search_enabled = True
+                try:
+                    self._reconcile_index()
+                except Exception as e:
+                    print(f"Warning: Could not reconcile the vector index with stored memories: {e}")
             except Exception as e:
                 print(f"Warning: Could not initialize vector search: {e}")
                 print("Falling back to text-based search.")
                 self.vector_search_enabled = False
     
+    def _load_encoder(self, embedding_model: str, backend: str):
+        """
+        Load the sentence transformer on the requested inference backend
+        
+        Encoders are reused across instances; encoding only reads the
+        model, so one copy can serve every store and thread.
+        """
+        key = (embedding_model, backend)
+        with _encoders_lock:
+            encoder = _encoders.get(key)
+            if encoder is None:
+                encoder = self._build_encoder(embedding_model, backend)
+                _encoders[key] = encoder
+        return encoder
+    
+    def _build_encoder(self, embedding_model: str, backend: str):
+        """Construct a sentence transformer, falling back to torch"""
+        if backend != "torch":
+            try:
+                return SentenceTransformer(embedding_model, backend=backend)
+            except Exception as e:
+                print(f"Warning: Could not load the {backend} embedding backend: {e}")
+                print("Falling back to the torch backend.")
+        return SentenceTransformer(embedding_model)
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """Return this thread's SQLite connection, opening it on first use"""
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            # check_same_thread=False only so close() can close every
+            # thread's connection; each connection is used by one thread
+            # The statement cache is larger than the default 128 because
+            # the IN (...) and filtered queries are built per call and
+            # would otherwise push the fixed hot statements out
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=512)
+            # WAL lets readers proceed while a write is in progress
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA mmap_size=268435456")
+            # 64MB page cache (negative values are in KiB)
+            conn.execute("PRAGMA cache_size=-65536")
+            holder = _ThreadConnection(conn)
+            self._local.holder = holder
+            with self._connections_lock:
+                self._connections.add(holder)
+        return holder.conn
+    
     def _init_database(self):
         """Initialize SQLite database schema"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_connection()
         cursor = conn.cursor()
         
         # Create memories table
@@ -97,49 +292,275 @@ class MemoryStorage:
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_session_type ON memories(session_id, type)
         """)
+        # Session reads are ordered by turn; these let SQLite walk the index
+        # in order (and stop early for pages) instead of sorting every row
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_session_turn ON memories(session_id, source_turn)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_session_type_turn ON memories(session_id, type, source_turn)
+        """)
+        
+        self.fts_enabled = self._init_fts(cursor)
         
         conn.commit()
-        conn.close()
+    
+    def _init_fts(self, cursor) -> bool:
+        """
+        Create the FTS5 index used by text search, kept in sync by triggers
+        
+        Returns:
+            False if this SQLite build has no FTS5; text search then falls
+            back to LIKE scans
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'memories_fts'")
+        exists = cursor.fetchone() is not None
+        
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts
+                USING fts5(content, value, content='memories', content_rowid='id')
+            """)
+        except sqlite3.OperationalError:
+            return False
+        
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+                INSERT INTO memories_fts(rowid, content, value) VALUES (new.id, new.content, new.value);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+                INSERT INTO memories_fts(memories_fts, rowid, content, value)
+                VALUES ('delete', old.id, old.content, old.value);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF content, value ON memories BEGIN
+                INSERT INTO memories_fts(memories_fts, rowid, content, value)
+                VALUES ('delete', old.id, old.content, old.value);
+                INSERT INTO memories_fts(rowid, content, value) VALUES (new.id, new.content, new.value);
+            END
+        """)
+        
+        # Index memories stored before the FTS table existed
+        if not exists:
+            cursor.execute("INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')")
+        
+        return True
     
     def _load_or_create_index(self):
         """Load existing FAISS index or create new one"""
-        index_path = "data/embeddings/faiss.index"
+        if self.index_dir is None:
+            return self._create_index()
         
+        index_path = os.path.join(self.index_dir, "faiss.index")
         if os.path.exists(index_path):
             try:
                 index = faiss.read_index(index_path)
-                return index
+                if index.d != self.embedding_dim:
+                    print(f"Warning: Saved index has dimension {index.d} but the encoder "
+                          f"produces {self.embedding_dim}; starting a new index.")
+                else:
+                    if os.path.exists(self._legacy_id_map_path()):
+                        index = self._from_legacy_index(index)
+                    if isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF)):
+                        if hasattr(index, "nprobe"):
+                            index.nprobe = self.nprobe
+                        return index
+                    # A position-keyed index without its id map can't be
+                    # matched to memories; start empty and let
+                    # _reconcile_index re-embed the stored rows
+                    print("Warning: Saved index is not keyed by memory ID; "
+                          "rebuilding it from stored memories.")
             except:
                 pass
         
         # Create new index
-        os.makedirs("data/embeddings", exist_ok=True)
-        index = faiss.IndexFlatL2(self.embedding_dim)
-        return index
+        os.makedirs(self.index_dir, exist_ok=True)
+        return self._create_index()
     
-    def _load_or_create_id_map(self):
-        """Load or create mapping between FAISS index positions and memory IDs"""
-        map_path = "data/embeddings/id_map.pkl"
+    def _create_index(self):
+        """
+        Create an empty index for this store's index_type
         
-        if os.path.exists(map_path):
-            try:
-                with open(map_path, 'rb') as f:
-                    return pickle.load(f)
-            except:
-                pass
+        The index is wrapped in an IndexIDMap2, so vectors are added and
+        searched by memory ID rather than by position. Embeddings are
+        normalized, so inner product ranks by cosine similarity.
+        """
+        if self.index_type == "hnsw":
+            # Graph index: search cost grows roughly logarithmically with
+            # the number of memories instead of linearly
+            index = faiss.IndexHNSWFlat(self.embedding_dim, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 64
+        elif self.index_type == "sqfp16":
+            # float16 components: half of float32's 4 bytes per dimension,
+            # with no training pass and negligible error on unit vectors
+            index = faiss.IndexScalarQuantizer(
+                self.embedding_dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            # "ivf" also starts flat, see _maybe_train_ivf
+            index = faiss.IndexFlatIP(self.embedding_dim)
+        return faiss.IndexIDMap2(index)
+    
+    def _indexed_ids(self) -> np.ndarray:
+        """Memory IDs that have a vector in the index"""
+        if isinstance(self.index, faiss.IndexIDMap2):
+            return faiss.vector_to_array(self.index.id_map)
+        
+        # Trained IVF indexes keep the IDs in their inverted lists
+        invlists = faiss.extract_index_ivf(self.index).invlists
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(invlists.nlist)
+        ])
+    
+    def _reconcile_index(self, batch_size: int = 512):
+        """
+        Bring a loaded index back in line with the memories table
+        
+        Vectors added after the last save are lost if the process stops
+        before the debounced save runs, while their rows are committed.
+        Those rows are embedded again, and vectors of rows deleted meanwhile
+        are dropped, so every stored memory stays searchable.
+        """
+        conn = self._get_connection()
+        stored_ids = np.fromiter(
+            (row[0] for row in conn.execute("SELECT id FROM memories")), dtype=np.int64
+        )
+        with self._index_lock:
+            indexed_ids = self._indexed_ids()
+        
+        stale_ids = np.setdiff1d(indexed_ids, stored_ids)
+        if len(stale_ids):
+            self._remove_from_vector_index(stale_ids.tolist())
+        
+        missing_ids = np.setdiff1d(stored_ids, indexed_ids).tolist()
+        if missing_ids:
+            print(f"Re-indexing {len(missing_ids)} memories missing from the vector index")
+        for start in range(0, len(missing_ids), batch_size):
+            batch = missing_ids[start:start + batch_size]
+            rows = conn.execute(
+                f"SELECT id, content FROM memories WHERE id IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            self._add_to_vector_index([row[0] for row in rows], [row[1] for row in rows])
+    
+    def _from_legacy_index(self, index):
+        """
+        Re-key an index saved with a separate position -> memory ID map
+        
+        Older stores pickled that map next to a position-keyed index. Its
+        vectors are copied into a new ID-keyed index; the map file is
+        removed the next time the index is saved.
+        """
+        try:
+            with open(self._legacy_id_map_path(), 'rb') as f:
+                id_map = pickle.load(f)
+        except:
+            id_map = []
+        
+        count = min(index.ntotal, len(id_map))
+        new_index = self._create_index()
+        if count:
+            if hasattr(index, "make_direct_map"):
+                # IVF indexes can only reconstruct with a direct map
+                index.make_direct_map()
+            vectors = np.ascontiguousarray(index.reconstruct_n(0, count), dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            new_index.add_with_ids(vectors, np.asarray(id_map[:count], dtype=np.int64))
+        return new_index
+    
+    def _maybe_train_ivf(self):
+        """
+        Replace a flat "ivf" index with a trained IVF one once it is big enough
+        
+        The flat index doubles as the training buffer. IVF indexes store
+        IDs themselves, so the vectors move over with their memory IDs.
+        Must be called with _index_lock held.
+        """
+        if self.index_type != "ivf" or not isinstance(self.index, faiss.IndexIDMap2):
+            return
+        if self.index.ntotal < 4 * self.ivf_nlist:
+            return
+        
+        vectors = faiss.downcast_index(self.index.index).reconstruct_n(0, self.index.ntotal)
+        memory_ids = faiss.vector_to_array(self.index.id_map)
+        index = faiss.index_factory(
+            self.embedding_dim, f"IVF{self.ivf_nlist},SQ8", self.index.metric_type
+        )
+        index.train(vectors)
+        index.add_with_ids(vectors, memory_ids)
+        index.nprobe = self.nprobe
+        self.index = index
+        self._refresh_gpu_index()
+        
+        # Persist right away so the trained index is what gets reloaded
+        self._save_index()
+    
+    def _refresh_gpu_index(self):
+        """
+        Copy self.index to the GPU, if one is available, for searching
         
-        return []
+        Adds go to both copies, so this is only needed when self.index is
+        replaced. Any failure leaves searches on the CPU index.
+        """
+        self._gpu_index = None
+        if not FAISS_USE_GPU or not hasattr(faiss, "StandardGpuResources"):
+            return
+        
+        try:
+            if faiss.get_num_gpus() == 0:
+                return
+            if self._gpu_resources is None:
+                self._gpu_resources = faiss.StandardGpuResources()
+            self._gpu_index = faiss.index_cpu_to_gpu(self._gpu_resources, 0, self.index)
+        except Exception as e:
+            print(f"Warning: Could not move FAISS index to GPU: {e}")
+            self._gpu_index = None
+    
+    def _search_index(self):
+        """Index to run searches on: the GPU replica when there is one"""
+        return self._gpu_index if self._gpu_index is not None else self.index
+    
+    def _legacy_id_map_path(self) -> str:
+        """Where older versions saved the position -> memory ID map"""
+        return os.path.join(self.index_dir, LEGACY_ID_MAP_NAME)
     
     def _save_index(self):
-        """Save FAISS index and ID mapping"""
+        """Save FAISS index"""
         if not self.vector_search_enabled:
             return
         
-        os.makedirs("data/embeddings", exist_ok=True)
-        faiss.write_index(self.index, "data/embeddings/faiss.index")
-        
-        with open("data/embeddings/id_map.pkl", 'wb') as f:
-            pickle.dump(self.memory_id_map, f)
+        with self._index_lock:
+            if self.index_dir is not None:
+                os.makedirs(self.index_dir, exist_ok=True)
+                faiss.write_index(self.index, os.path.join(self.index_dir, "faiss.index"))
+                
+                # The saved index now carries its own IDs
+                if os.path.exists(self._legacy_id_map_path()):
+                    os.remove(self._legacy_id_map_path())
+            
+            self._index_dirty = False
+    
+    def flush(self):
+        """Write the FAISS index to disk if it has unsaved vectors"""
+        with self._index_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._index_dirty:
+                self._save_index()
+    
+    def _schedule_save(self):
+        """Mark the index dirty and start the debounced save if none is pending"""
+        self._index_dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.index_save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
     
     def store_memory(self, memory: Dict[str, Any]) -> int:
         """
@@ -149,113 +570,225 @@ class MemoryStorage:
             memory: Memory dictionary
             
         Returns:
-            Memory ID
+            Memory ID, or -1 if the memory already exists
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return self.store_memories([memory])[0]
+    
+    def store_memories(self, memories: List[Dict[str, Any]]) -> List[int]:
+        """
+        Store multiple memories in a single transaction
         
-        try:
-            cursor.execute("""
-                INSERT INTO memories 
-                (session_id, type, content, key, value, confidence, source_turn, 
-                 created_at, last_accessed, access_count, raw_text)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                memory.get("session_id"),
-                memory.get("type"),
-                memory.get("content"),
-                memory.get("key"),
-                memory.get("value"),
-                memory.get("confidence"),
-                memory.get("source_turn"),
-                memory.get("created_at"),
-                memory.get("last_accessed"),
-                memory.get("access_count", 0),
-                memory.get("raw_text")
-            ))
-            
-            memory_id = cursor.lastrowid
+        Embeddings for the newly inserted memories are computed in one batch
+        and added to the vector index with a single call.
+        
+        Args:
+            memories: Memory dictionaries
             
-            # Add to vector index if enabled
-            if self.vector_search_enabled:
-                self._add_to_vector_index(memory_id, memory.get("content"))
+        Returns:
+            One memory ID per input memory, -1 where the memory already existed
+        """
+        if not memories:
+            return []
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        memory_ids = []
+        
+        with self._write_lock:
+            for memory in memories:
+                try:
+                    cursor.execute("""
+                        INSERT INTO memories 
+                        (session_id, type, content, key, value, confidence, source_turn, 
+                         created_at, last_accessed, access_count, raw_text)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (
+                        memory.get("session_id"),
+                        memory.get("type"),
+                        memory.get("content"),
+                        memory.get("key"),
+                        memory.get("value"),
+                        memory.get("confidence"),
+                        memory.get("source_turn"),
+                        memory.get("created_at"),
+                        memory.get("last_accessed"),
+                        memory.get("access_count", 0),
+                        memory.get("raw_text")
+                    ))
+                    memory_ids.append(cursor.lastrowid)
+                except sqlite3.IntegrityError:
+                    # Memory already exists; only this statement is undone
+                    memory_ids.append(-1)
             
             conn.commit()
-            return memory_id
-            
-        except sqlite3.IntegrityError:
-            # Memory already exists
-            return -1
-        finally:
-            conn.close()
-    
-    def store_memories(self, memories: List[Dict[str, Any]]) -> List[int]:
-        """Store multiple memories"""
-        memory_ids = []
-        for memory in memories:
-            memory_id = self.store_memory(memory)
-            if memory_id != -1:
-                memory_ids.append(memory_id)
+        
+        # Add to vector index if enabled. Encoding runs outside the write
+        # lock, so other threads' SQLite writes aren't held up by the
+        # encoder; the index is keyed by memory ID, so the order in which
+        # concurrent batches reach it doesn't matter
+        if self.vector_search_enabled:
+            new_memories = [
+                (memory_id, memory.get("content"))
+                for memory, memory_id in zip(memories, memory_ids)
+                if memory_id != -1
+            ]
+            if new_memories:
+                new_ids, contents = zip(*new_memories)
+                self._add_to_vector_index(list(new_ids), list(contents))
+        
         return memory_ids
     
-    def _add_to_vector_index(self, memory_id: int, content: str):
-        """Add memory to FAISS vector index"""
+    def _add_to_vector_index(self, memory_ids: List[int], contents: List[str]):
+        """Add memories to FAISS vector index"""
         if not self.vector_search_enabled:
             return
         
-        # Generate embedding
-        embedding = self.encoder.encode([content])[0]
-        embedding = np.array([embedding], dtype=np.float32)
+        # Generate embeddings in one batch
+        embeddings = self._encode_texts(contents, batch_size=64)
         
         # Add to index
-        self.index.add(embedding)
-        self.memory_id_map.append(memory_id)
-        
-        # Save periodically (every 10 memories)
-        if len(self.memory_id_map) % 10 == 0:
-            self._save_index()
+        with self._index_lock:
+            ids = np.asarray(memory_ids, dtype=np.int64)
+            self.index.add_with_ids(embeddings, ids)
+            if self._gpu_index is not None:
+                self._gpu_index.add_with_ids(embeddings, ids)
+            self._schedule_save()
+            self._maybe_train_ivf()
     
     def get_memory(self, memory_id: int) -> Optional[Dict[str, Any]]:
         """Retrieve a specific memory by ID"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_connection()
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM memories WHERE id = ?", (memory_id,))
         row = cursor.fetchone()
         
-        conn.close()
-        
         if row:
-            return self._row_to_dict(row)
+            return _row_to_dict(row)
         return None
     
     def get_session_memories(
         self, 
         session_id: str, 
         memory_type: Optional[str] = None,
-        min_confidence: float = 0.0
+        min_confidence: float = 0.0,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        start_turn: Optional[int] = None,
+        end_turn: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """Retrieve all memories for a session"""
-        conn = sqlite3.connect(self.db_path)
+        """
+        Retrieve memories for a session, ordered by source turn
+        
+        Args:
+            session_id: Session identifier
+            memory_type: Optional memory type filter
+            min_confidence: Minimum confidence threshold
+            limit: Maximum number of memories to return (None for all)
+            offset: Number of memories to skip
+            start_turn: Earliest source turn to include (inclusive)
+            end_turn: Latest source turn to include (inclusive)
+        """
+        conn = self._get_connection()
         cursor = conn.cursor()
         
+        where, params = self._session_filter(
+            session_id, memory_type, min_confidence, start_turn, end_turn
+        )
+        
+        # SQLite treats a negative LIMIT as "no limit"
+        params.extend([-1 if limit is None else limit, offset])
+        
+        cursor.execute(f"""
+            SELECT * FROM memories 
+            WHERE {where}
+            ORDER BY source_turn
+            LIMIT ? OFFSET ?
+        """, params)
+        
+        rows = cursor.fetchall()
+        return [_row_to_dict(row) for row in rows]
+    
+    def count_session_memories(
+        self,
+        session_id: str,
+        memory_type: Optional[str] = None,
+        min_confidence: float = 0.0,
+        start_turn: Optional[int] = None,
+        end_turn: Optional[int] = None
+    ) -> int:
+        """
+        Count the memories get_session_memories would return without paging
+        
+        Takes the same filters, so a caller paging with limit/offset can
+        tell how many memories there are in total.
+        """
+        conn = self._get_connection()
+        
+        where, params = self._session_filter(
+            session_id, memory_type, min_confidence, start_turn, end_turn
+        )
+        
+        return conn.execute(f"SELECT COUNT(*) FROM memories WHERE {where}", params).fetchone()[0]
+    
+    def _session_filter(
+        self,
+        session_id: str,
+        memory_type: Optional[str],
+        min_confidence: float,
+        start_turn: Optional[int],
+        end_turn: Optional[int]
+    ) -> tuple:
+        """Build the WHERE clause and parameters for a session's memories"""
+        conditions = ["session_id = ?"]
+        params: List[Any] = [session_id]
+        
         if memory_type:
-            cursor.execute("""
-                SELECT * FROM memories 
-                WHERE session_id = ? AND type = ? AND confidence >= ?
-                ORDER BY source_turn
-            """, (session_id, memory_type, min_confidence))
-        else:
-            cursor.execute("""
-                SELECT * FROM memories 
-                WHERE session_id = ? AND confidence >= ?
-                ORDER BY source_turn
-            """, (session_id, min_confidence))
+            conditions.append("type = ?")
+            params.append(memory_type)
+        if start_turn is not None:
+            conditions.append("source_turn >= ?")
+            params.append(start_turn)
+        if end_turn is not None:
+            conditions.append("source_turn <= ?")
+            params.append(end_turn)
+        
+        conditions.append("confidence >= ?")
+        params.append(min_confidence)
+        
+        return " AND ".join(conditions), params
+    
+    def get_session_block(self, session_id: str) -> Optional[SessionBlock]:
+        """
+        Retrieve all memories for a session as a SessionBlock
+        
+        Returns:
+            The same memories as get_session_memories(session_id), or
+            None if there are none
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT * FROM memories 
+            WHERE session_id = ? AND confidence >= 0.0
+            ORDER BY source_turn
+        """, (session_id,))
         
         rows = cursor.fetchall()
-        conn.close()
+        if not rows:
+            return None
         
-        return [self._row_to_dict(row) for row in rows]
+        columns = list(zip(*rows))
+        return SessionBlock(
+            rows=rows,
+            ids=np.array(columns[0], dtype=np.int64),
+            source_turns=np.array(columns[7], dtype=np.float64),
+            confidences=np.array(columns[6], dtype=np.float64),
+            access_counts=np.array(columns[10], dtype=np.float64),
+            types=columns[2],
+            contents=columns[3]
+        )
     
     def search_memories_by_content(
         self, 
@@ -278,35 +811,173 @@ class MemoryStorage:
             # Fallback to simple text search
             return self._text_search(query, session_id, top_k)
         
-        # Generate query embedding
-        query_embedding = self.encoder.encode([query])[0]
-        query_embedding = np.array([query_embedding], dtype=np.float32)
+        if self.index.ntotal == 0:
+            return []
+        
+        # Generate query embedding (cached for repeated queries)
+        query_embedding = self._encode_texts([query])
         
         # Search in FAISS index
-        distances, indices = self.index.search(query_embedding, min(top_k * 2, len(self.memory_id_map)))
-        
-        # Retrieve memories
-        memories = []
-        for idx in indices[0]:
-            if idx < len(self.memory_id_map):
-                memory_id = self.memory_id_map[idx]
-                memory = self.get_memory(memory_id)
-                
-                if memory:
-                    # Filter by session if specified
-                    if session_id is None or memory.get("session_id") == session_id:
-                        memories.append(memory)
-                        
-                        if len(memories) >= top_k:
-                            break
+        with self._index_lock:
+            distances, memory_ids = self._search_index().search(query_embedding, min(top_k * 2, self.index.ntotal))
         
-        return memories
+        return self._collect_search_hits(memory_ids, session_id, top_k)[0]
+    
+    def search_memories_by_contents(
+        self,
+        queries: List[str],
+        session_id: Optional[str] = None,
+        top_k: int = 5
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search memories for several queries at once
+        
+        All queries are encoded in a single batch and looked up with one
+        FAISS search call.
+        
+        Args:
+            queries: Search queries
+            session_id: Optional session filter
+            top_k: Number of results to return per query
+            
+        Returns:
+            List of result lists, one per query
+        """
+        if not self.vector_search_enabled:
+            return [self._text_search(query, session_id, top_k) for query in queries]
+        
+        if not queries or self.index.ntotal == 0:
+            return [[] for _ in queries]
+        
+        query_embeddings = self._encode_texts(queries, batch_size=32)
+        
+        with self._index_lock:
+            distances, memory_ids = self._search_index().search(query_embeddings, min(top_k * 2, self.index.ntotal))
+        
+        return self._collect_search_hits(memory_ids, session_id, top_k)
+    
+    def _encode_texts(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Encode texts into a contiguous (len(texts), dim) float32 array
+        
+        Texts in the embedding cache skip the encoder; the rest are
+        encoded together in one batch, and cached if short enough.
+        """
+        cache = self._embedding_cache
+        embeddings: List[Optional[np.ndarray]] = []
+        with self._embedding_cache_lock:
+            for text in texts:
+                embedding = cache.get(text)
+                if embedding is not None:
+                    cache.move_to_end(text)
+                embeddings.append(embedding)
+        
+        missing = list(dict.fromkeys(
+            text for text, embedding in zip(texts, embeddings) if embedding is None
+        ))
+        if missing:
+            encoded = np.asarray(
+                self.encoder.encode(
+                    missing, batch_size=batch_size, show_progress_bar=False,
+                    convert_to_numpy=True, normalize_embeddings=True
+                ),
+                dtype=np.float32
+            )
+            fresh = dict(zip(missing, encoded))
+            
+            with self._embedding_cache_lock:
+                for text, embedding in fresh.items():
+                    if len(text) <= MAX_CACHED_TEXT_LENGTH:
+                        cache[text] = embedding
+                while len(cache) > EMBEDDING_CACHE_SIZE:
+                    cache.popitem(last=False)
+            
+            if len(missing) == len(texts):
+                # Nothing cached or repeated: the encoder output is already
+                # the result, so hand it to FAISS without another copy
+                return np.ascontiguousarray(encoded)
+            
+            embeddings = [fresh[text] if embedding is None else embedding
+                          for text, embedding in zip(texts, embeddings)]
+        
+        return np.stack(embeddings)
+    
+    def _collect_search_hits(
+        self,
+        id_rows,
+        session_id: Optional[str],
+        top_k: int
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Resolve FAISS result IDs to memories, applying the session filter
+        
+        The hits of every row are fetched with a single query, with the
+        session filter applied in SQL rather than after fetching.
+        
+        Returns:
+            One list of up to top_k memories per row, in FAISS rank order
+        """
+        # FAISS pads rows with -1 when it finds fewer than k results
+        hit_ids = [
+            [int(memory_id) for memory_id in id_row if memory_id >= 0]
+            for id_row in id_rows
+        ]
+        
+        candidate_ids = list({memory_id for row_ids in hit_ids for memory_id in row_ids})
+        rows_by_id = {}
+        if candidate_ids:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            sql = f"SELECT * FROM memories WHERE id IN ({','.join('?' * len(candidate_ids))})"
+            params: List[Any] = candidate_ids
+            if session_id is not None:
+                sql += " AND session_id = ?"
+                params = candidate_ids + [session_id]
+            
+            cursor.execute(sql, params)
+            rows_by_id = {row[0]: row for row in cursor.fetchall()}
+        
+        results = []
+        for row_ids in hit_ids:
+            memories = []
+            for memory_id in row_ids:
+                row = rows_by_id.get(memory_id)
+                if row is not None:
+                    memories.append(_row_to_dict(row))
+                    if len(memories) >= top_k:
+                        break
+            results.append(memories)
+        
+        return results
     
     def _text_search(self, query: str, session_id: Optional[str], top_k: int) -> List[Dict[str, Any]]:
-        """Fallback text search using SQLite"""
-        conn = sqlite3.connect(self.db_path)
+        """
+        Fallback text search using SQLite
+        
+        Uses the FTS5 index when available: the query is matched as a
+        phrase whose last word may be a prefix, best matches first.
+        Otherwise falls back to a substring scan, most confident first.
+        """
+        conn = self._get_connection()
         cursor = conn.cursor()
         
+        # Queries without any word characters have nothing to match in FTS
+        if self.fts_enabled and any(ch.isalnum() for ch in query):
+            phrase = '"' + query.replace('"', '""') + '"*'
+            session_filter = "AND m.session_id = ?" if session_id else ""
+            params = [phrase, session_id, top_k] if session_id else [phrase, top_k]
+            
+            cursor.execute(f"""
+                SELECT m.* FROM memories_fts f
+                JOIN memories m ON m.id = f.rowid
+                WHERE memories_fts MATCH ? {session_filter}
+                ORDER BY f.rank, m.confidence DESC
+                LIMIT ?
+            """, params)
+            
+            return [_row_to_dict(row) for row in cursor.fetchall()]
+        
         query_pattern = f"%{query}%"
         
         if session_id:
@@ -325,40 +996,77 @@ class MemoryStorage:
             """, (query_pattern, query_pattern, top_k))
         
         rows = cursor.fetchall()
-        conn.close()
-        
-        return [self._row_to_dict(row) for row in rows]
+        return [_row_to_dict(row) for row in rows]
     
     def update_memory_access(self, memory_id: int):
         """Update last accessed time and increment access count"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.update_memory_access_bulk([memory_id])
+    
+    def update_memory_access_bulk(self, memory_ids: List[int]):
+        """
+        Record accesses for several memories in a single transaction
         
-        cursor.execute("""
-            UPDATE memories 
-            SET last_accessed = ?, access_count = access_count + 1
-            WHERE id = ?
-        """, (datetime.utcnow().isoformat(), memory_id))
+        Every occurrence counts, so an ID listed twice has its access count
+        incremented twice. Repeats are folded into one UPDATE per memory.
+        """
+        if not memory_ids:
+            return
         
-        conn.commit()
-        conn.close()
+        conn = self._get_connection()
+        now_iso = datetime.now(timezone.utc).isoformat()
+        deltas = Counter(memory_ids)
+        
+        with self._write_lock:
+            conn.executemany("""
+                UPDATE memories 
+                SET last_accessed = ?, access_count = access_count + ?
+                WHERE id = ?
+            """, [(now_iso, delta, memory_id) for memory_id, delta in deltas.items()])
+            
+            conn.commit()
     
     def delete_session_memories(self, session_id: str):
-        """Delete all memories for a session"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Delete all memories for a session, and their vectors"""
+        conn = self._get_connection()
         
-        cursor.execute("DELETE FROM memories WHERE session_id = ?", (session_id,))
+        with self._write_lock:
+            memory_ids = [
+                row[0] for row in
+                conn.execute("SELECT id FROM memories WHERE session_id = ?", (session_id,))
+            ]
+            conn.execute("DELETE FROM memories WHERE session_id = ?", (session_id,))
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        self._remove_from_vector_index(memory_ids)
+    
+    def _remove_from_vector_index(self, memory_ids: List[int]):
+        """
+        Drop deleted memories' vectors from the FAISS index
+        
+        Otherwise they keep taking candidate slots in every search. The
+        index is keyed by memory ID, so flat, sqfp16 and IVF indexes remove
+        them in place; HNSW graphs can't remove vectors, and there the
+        search drops the stale hits when the rows aren't found.
+        """
+        if not self.vector_search_enabled or not memory_ids:
+            return
         
-        # Note: This doesn't remove from FAISS index (would require rebuild)
-        # For production, implement periodic index rebuilding
+        with self._index_lock:
+            try:
+                removed = self.index.remove_ids(np.asarray(memory_ids, dtype=np.int64))
+            except RuntimeError:
+                # Raised by indexes that don't implement removal (HNSW)
+                return
+            
+            if removed:
+                # GPU copies don't all support removal, so rebuild the replica
+                if self._gpu_index is not None:
+                    self._refresh_gpu_index()
+                self._schedule_save()
     
     def get_memory_stats(self, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Get statistics about stored memories"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_connection()
         cursor = conn.cursor()
         
         if session_id:
@@ -382,8 +1090,6 @@ class MemoryStorage:
             """)
         
         row = cursor.fetchone()
-        conn.close()
-        
         return {
             "total_memories": row[0],
             "avg_confidence": row[1],
@@ -391,27 +1097,16 @@ class MemoryStorage:
             "latest_turn": row[3]
         }
     
-    def _row_to_dict(self, row) -> Dict[str, Any]:
-        """Convert SQLite row to dictionary"""
-        return {
-            "id": row[0],
-            "session_id": row[1],
-            "type": row[2],
-            "content": row[3],
-            "key": row[4],
-            "value": row[5],
-            "confidence": row[6],
-            "source_turn": row[7],
-            "created_at": row[8],
-            "last_accessed": row[9],
-            "access_count": row[10],
-            "raw_text": row[11]
-        }
-    
     def close(self):
         """Clean up resources"""
         if self.vector_search_enabled:
-            self._save_index()
+            self.flush()
+        
+        with self._connections_lock:
+            for holder in list(self._connections):
+                holder.conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
 
 # Example usage
@@ -427,7 +1122,7 @@ if __name__ == "__main__":
         "value": "Kannada",
         "confidence": 0.95,
         "source_turn": 1,
-        "created_at": datetime.utcnow().isoformat(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
         "last_accessed": None,
         "access_count": 0,
         "raw_text": "My preferred language is Kannada"
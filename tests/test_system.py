@@ -5,8 +5,14 @@ Unit Tests for Long-Form Memory System
 import pytest
 import sys
 import os
-import tempfile
 import shutil
+import contextlib
+import time
+import threading
+import pickle
+import zlib
+
+import numpy as np
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
@@ -22,9 +28,13 @@ class TestMemoryExtraction:
     def setup_method(self):
         self.extractor = MemoryExtractor()
     
-    def test_extract_preference(self):
-        """Test preference extraction"""
-        message = "My preferred language is Kannada"
+    @pytest.mark.parametrize("message, memory_type, needle", [
+        ("My preferred language is Kannada", MemoryType.PREFERENCE.value, "kannada"),
+        ("Please call me only after 11 AM", MemoryType.CONSTRAINT.value, "11"),
+        ("Can you call me tomorrow?", MemoryType.COMMITMENT.value, ""),
+    ], ids=["preference", "constraint", "commitment"])
+    def test_extract_by_type(self, message, memory_type, needle):
+        """Test that each message yields a memory of its type mentioning the needle"""
         memories = self.extractor.extract_memories(
             user_message=message,
             assistant_response="Got it!",
@@ -32,37 +42,9 @@ class TestMemoryExtraction:
             session_id="test"
         )
         
-        # Should extract at least one preference
-        prefs = [m for m in memories if m['type'] == MemoryType.PREFERENCE.value]
-        assert len(prefs) > 0
-        assert any('kannada' in m['content'].lower() for m in prefs)
-    
-    def test_extract_constraint(self):
-        """Test constraint extraction"""
-        message = "Please call me only after 11 AM"
-        memories = self.extractor.extract_memories(
-            user_message=message,
-            assistant_response="I'll remember that",
-            turn_number=1,
-            session_id="test"
-        )
-        
-        constraints = [m for m in memories if m['type'] == MemoryType.CONSTRAINT.value]
-        assert len(constraints) > 0
-        assert any('11' in m['content'] for m in constraints)
-    
-    def test_extract_commitment(self):
-        """Test commitment extraction"""
-        message = "Can you call me tomorrow?"
-        memories = self.extractor.extract_memories(
-            user_message=message,
-            assistant_response="Sure",
-            turn_number=1,
-            session_id="test"
-        )
-        
-        commitments = [m for m in memories if m['type'] == MemoryType.COMMITMENT.value]
-        assert len(commitments) > 0
+        matches = [m for m in memories if m['type'] == memory_type]
+        assert len(matches) > 0
+        assert any(needle in m['content'].lower() for m in matches)
     
     def test_confidence_scoring(self):
         """Test that confidence scores are reasonable"""
@@ -99,20 +81,35 @@ class TestMemoryExtraction:
         
         unique = self.extractor.deduplicate_memories(memories)
         assert len(unique) == 2
+    
+    def test_repeated_message_uses_fresh_copies(self):
+        """Test that cached extraction results are stamped per turn and not shared"""
+        first = self.extractor.extract_memories("My preferred language is Kannada", "", 1, "s1")
+        first[0]['content'] = 'changed'
+        second = self.extractor.extract_memories("My preferred language is Kannada", "", 7, "s2")
+        
+        assert second[0]['content'] != 'changed'
+        assert second[0]['source_turn'] == 7
+        assert second[0]['session_id'] == "s2"
+    
+    def test_fact_patterns_are_bounded(self):
+        """Test that long messages yield bounded fact matches"""
+        text = "word " * 2000 + "is here and " + "more " * 2000
+        facts = self.extractor._extract_facts(text)
+        
+        assert len(facts) > 0
+        assert all(len(fact.content) <= 300 for fact in facts)
 
 
 class TestMemoryStorage:
     """Test memory storage functionality"""
     
-    def setup_method(self):
-        # Create temporary database
-        self.temp_dir = tempfile.mkdtemp()
-        self.db_path = os.path.join(self.temp_dir, "test_memories.db")
-        self.storage = MemoryStorage(db_path=self.db_path)
-    
-    def teardown_method(self):
-        self.storage.close()
-        shutil.rmtree(self.temp_dir)
+    @pytest.fixture(autouse=True)
+    def storage(self):
+        # In-memory database; these tests only use it from one thread
+        with contextlib.closing(MemoryStorage(db_path=":memory:")) as storage:
+            self.storage = storage
+            yield
     
     def test_store_and_retrieve_memory(self):
         """Test basic storage and retrieval"""
@@ -141,9 +138,9 @@ class TestMemoryStorage:
         """Test retrieving all memories for a session"""
         session_id = "test_session"
         
-        # Store multiple memories
-        for i in range(3):
-            memory = {
+        # Store multiple memories in one transaction
+        self.storage.store_memories([
+            {
                 "session_id": session_id,
                 "type": "fact",
                 "content": f"fact {i}",
@@ -156,10 +153,81 @@ class TestMemoryStorage:
                 "access_count": 0,
                 "raw_text": f"test {i}"
             }
-            self.storage.store_memory(memory)
+            for i in range(3)
+        ])
         
         memories = self.storage.get_session_memories(session_id)
         assert len(memories) == 3
+        
+        # Paging returns consecutive slices in source-turn order
+        page = self.storage.get_session_memories(session_id, limit=2, offset=1)
+        assert [m['source_turn'] for m in page] == [1, 2]
+        assert self.storage.count_session_memories(session_id) == 3
+        assert self.storage.count_session_memories(session_id, min_confidence=0.9) == 0
+    
+    def test_get_session_block(self):
+        """Test the column view of a session matches its memory dicts"""
+        session_id = "test_session"
+        
+        for i in range(3):
+            memory = {
+                "session_id": session_id,
+                "type": "fact",
+                "content": f"fact {i}",
+                "key": "test",
+                "value": f"value {i}",
+                "confidence": 0.8,
+                "source_turn": 2 - i,
+                "created_at": "2024-01-01T00:00:00",
+                "last_accessed": None,
+                "access_count": i,
+                "raw_text": f"test {i}"
+            }
+            self.storage.store_memory(memory)
+        
+        block = self.storage.get_session_block(session_id)
+        memories = self.storage.get_session_memories(session_id)
+        
+        assert list(block.source_turns) == [0, 1, 2]
+        assert list(block.access_counts) == [2, 1, 0]
+        assert list(block.contents) == [m['content'] for m in memories]
+        assert [block.memory(i) for i in range(3)] == memories
+        assert self.storage.get_session_block("missing_session") is None
+    
+    def test_thread_connections_close_on_exit(self, tmp_path):
+        """Test that connections opened by finished threads don't accumulate"""
+        with contextlib.closing(MemoryStorage(db_path=str(tmp_path / "test_memories.db"))) as storage:
+            for _ in range(50):
+                thread = threading.Thread(target=storage.get_session_memories, args=("test_session",))
+                thread.start()
+                thread.join()
+            
+            # Only this thread's connection, opened by the constructor, is left
+            assert len(storage._connections) == 1
+    
+    def test_store_memories_marks_duplicates(self):
+        """Test that batch storage returns one ID per memory, -1 for duplicates"""
+        memory = {
+            "session_id": "test_session",
+            "type": "preference",
+            "content": "language is Kannada",
+            "key": "language",
+            "value": "Kannada",
+            "confidence": 0.95,
+            "source_turn": 1,
+            "created_at": "2024-01-01T00:00:00",
+            "last_accessed": None,
+            "access_count": 0,
+            "raw_text": "My language is Kannada"
+        }
+        other = dict(memory, key="name", value="Arun", content="call me Arun")
+        
+        memory_ids = self.storage.store_memories([memory, memory, other])
+        
+        assert len(memory_ids) == 3
+        assert memory_ids[0] > 0 and memory_ids[2] > 0
+        assert memory_ids[1] == -1
+        assert len(self.storage.get_session_memories("test_session")) == 2
     
     def test_filter_by_type(self):
         """Test filtering memories by type"""
@@ -167,8 +235,8 @@ class TestMemoryStorage:
         
         # Store different types
         types = ["preference", "fact", "constraint"]
-        for mem_type in types:
-            memory = {
+        self.storage.store_memories([
+            {
                 "session_id": session_id,
                 "type": mem_type,
                 "content": f"test {mem_type}",
@@ -181,7 +249,8 @@ class TestMemoryStorage:
                 "access_count": 0,
                 "raw_text": "test"
             }
-            self.storage.store_memory(memory)
+            for mem_type in types
+        ])
         
         prefs = self.storage.get_session_memories(session_id, memory_type="preference")
         assert len(prefs) == 1
@@ -211,20 +280,69 @@ class TestMemoryStorage:
         retrieved = self.storage.get_memory(memory_id)
         assert retrieved['access_count'] == 1
         assert retrieved['last_accessed'] is not None
+        
+        # Bulk updates count every occurrence
+        self.storage.update_memory_access_bulk([memory_id, memory_id])
+        assert self.storage.get_memory(memory_id)['access_count'] == 3
+    
+    def test_batch_search(self):
+        """Test searching several queries at once"""
+        for i, content in enumerate(["language is Kannada", "call after 11 AM"]):
+            memory = {
+                "session_id": "test_session",
+                "type": "preference",
+                "content": content,
+                "key": "test",
+                "value": content,
+                "confidence": 0.9,
+                "source_turn": i,
+                "created_at": "2024-01-01T00:00:00",
+                "last_accessed": None,
+                "access_count": 0,
+                "raw_text": content
+            }
+            self.storage.store_memory(memory)
+        
+        queries = ["Kannada", "11 AM"]
+        batch = self.storage.search_memories_by_contents(queries, session_id="test_session")
+        
+        assert len(batch) == len(queries)
+        for query, results in zip(queries, batch):
+            assert results == self.storage.search_memories_by_content(query, session_id="test_session")
+    
+    def test_text_search_prefix_and_delete(self):
+        """Test that text search matches word prefixes and drops deleted memories"""
+        for session_id in ["test_session", "other_session"]:
+            self.storage.store_memory({
+                "session_id": session_id,
+                "type": "preference",
+                "content": "language is Kannada",
+                "key": "language",
+                "value": "Kannada",
+                "confidence": 0.9,
+                "source_turn": 1,
+                "created_at": "2024-01-01T00:00:00",
+                "last_accessed": None,
+                "access_count": 0,
+                "raw_text": "My language is Kannada"
+            })
+        
+        assert len(self.storage._text_search("Kann", None, 5)) == 2
+        
+        self.storage.delete_session_memories("other_session")
+        results = self.storage._text_search("Kann", None, 5)
+        assert [m['session_id'] for m in results] == ["test_session"]
 
 
 class TestMemoryRetrieval:
     """Test memory retrieval functionality"""
     
-    def setup_method(self):
-        self.temp_dir = tempfile.mkdtemp()
-        self.db_path = os.path.join(self.temp_dir, "test_memories.db")
-        self.storage = MemoryStorage(db_path=self.db_path)
-        self.retriever = MemoryRetriever(self.storage)
-    
-    def teardown_method(self):
-        self.storage.close()
-        shutil.rmtree(self.temp_dir)
+    @pytest.fixture(autouse=True)
+    def storage(self):
+        with contextlib.closing(MemoryStorage(db_path=":memory:")) as storage:
+            self.storage = storage
+            self.retriever = MemoryRetriever(storage)
+            yield
     
     def test_retrieve_relevant_memories(self):
         """Test relevance-based retrieval"""
@@ -306,19 +424,62 @@ class TestMemoryRetrieval:
         # More recent memory should have higher relevance
         if len(relevant) >= 2:
             assert relevant[0]['source_turn'] >= relevant[-1]['source_turn']
+    
+    def test_retrieve_by_turn_range(self):
+        """Test that turn-range retrieval is inclusive and ordered by turn"""
+        session_id = "test_session"
+        
+        for turn in [30, 10, 20, 40]:
+            self.storage.store_memory({
+                "session_id": session_id,
+                "type": "fact",
+                "content": f"fact from turn {turn}",
+                "key": "test",
+                "value": f"turn {turn}",
+                "confidence": 0.8,
+                "source_turn": turn,
+                "created_at": "2024-01-01T00:00:00",
+                "last_accessed": None,
+                "access_count": 0,
+                "raw_text": f"test {turn}"
+            })
+        
+        in_range = self.retriever.retrieve_by_turn_range(session_id, 10, 30)
+        assert [m['source_turn'] for m in in_range] == [10, 20, 30]
+    
+    def test_format_memories_groups_by_priority(self):
+        """Test that prompt sections follow type priority, then first appearance"""
+        memories = [
+            {"type": "fact", "content": "sky is blue", "source_turn": 3, "confidence": 0.6},
+            {"type": "custom", "content": "something else", "source_turn": 2, "confidence": 0.5},
+            {"type": "preference", "content": "language is Kannada", "source_turn": 1, "confidence": 0.95},
+        ]
+        
+        formatted = self.retriever.format_memories_for_prompt(memories, include_metadata=True)
+        
+        assert formatted.index("### Preferences") < formatted.index("### Facts") < formatted.index("### Customs")
+        assert "- language is Kannada (from turn 1, confidence: 0.95)" in formatted
 
 
 class TestConversationAgent:
     """Test end-to-end conversation agent"""
     
-    def setup_method(self):
-        self.temp_dir = tempfile.mkdtemp()
-        self.db_path = os.path.join(self.temp_dir, "test_memories.db")
-        self.agent = ConversationAgent(db_path=self.db_path, verbose=False)
+    @pytest.fixture(scope="class", autouse=True)
+    def template_db(self, request, tmp_path_factory):
+        # Build the schema once; each test starts from a copy of it
+        path = str(tmp_path_factory.mktemp("template") / "template.db")
+        MemoryStorage(db_path=path).close()
+        request.cls.template_db = path
     
-    def teardown_method(self):
-        self.agent.close()
-        shutil.rmtree(self.temp_dir)
+    @pytest.fixture(autouse=True)
+    def agent_db(self, template_db, tmp_path):
+        # pytest removes tmp_path directories itself, in bulk
+        self.db_path = str(tmp_path / "test_memories.db")
+        shutil.copyfile(self.template_db, self.db_path)
+        agent = ConversationAgent(db_path=self.db_path, verbose=False)
+        with contextlib.closing(agent):
+            self.agent = agent
+            yield
     
     def test_process_turn(self):
         """Test processing a conversation turn"""
@@ -331,6 +492,7 @@ class TestConversationAgent:
         assert 'assistant_response' in response
         assert 'extracted_memories' in response
         assert len(response['extracted_memories']) > 0
+        assert response['memories_pending'] is False
     
     def test_long_range_memory(self):
         """Test memory retention across many turns"""
@@ -355,6 +517,115 @@ class TestConversationAgent:
         # Should have active memories
         assert len(response100.get('active_memories', [])) > 0
     
+    def test_background_storage(self):
+        """Test that memories stored in the background are visible to later turns"""
+        agent = ConversationAgent(db_path=self.db_path, verbose=False, background_storage=True)
+        with contextlib.closing(agent):
+            session_id = "background_session"
+            
+            response1 = agent.process_turn(
+                session_id=session_id,
+                user_message="My preferred language is Kannada",
+                turn_number=1
+            )
+            assert len(response1['extracted_memories']) > 0
+            assert response1['memories_pending'] is True
+            
+            response100 = agent.process_turn(
+                session_id=session_id,
+                user_message="What language do I prefer?",
+                turn_number=100
+            )
+            assert len(response100.get('active_memories', [])) > 0
+    
+    def test_minimal_response(self):
+        """Test that minimal mode returns only the reply fields"""
+        response = self.agent.process_turn(
+            session_id="test_session",
+            user_message="My preferred language is Kannada",
+            turn_number=1,
+            minimal=True
+        )
+        
+        assert set(response) == {'session_id', 'turn_number', 'assistant_response'}
+    
+    def test_response_cache(self):
+        """Test that an identical repeated turn is answered from cache"""
+        agent = ConversationAgent(db_path=self.db_path, verbose=False, response_cache_ttl=60)
+        with contextlib.closing(agent):
+            first = agent.process_turn("cache_session", "My preferred language is Kannada", turn_number=1)
+            again = agent.process_turn("cache_session", "My preferred language is Kannada", turn_number=1)
+            other = agent.process_turn("cache_session", "My preferred language is Kannada", turn_number=2)
+            
+            assert again == first and again is not first
+            assert other != first
+            
+            # Changing a returned response doesn't change later hits
+            again["assistant_response"] = "changed"
+            assert agent.process_turn("cache_session", "My preferred language is Kannada", turn_number=1) == first
+            
+            # Without a turn number every message is a new turn
+            agent.process_turn("cache_session", "Hello")
+            agent.process_turn("cache_session", "Hello")
+            assert agent.sessions["cache_session"].turn_count == 4
+            
+            # Clearing one session keeps the others' cached responses
+            kept = agent.process_turn("other_session", "Hello", turn_number=1)
+            agent.clear_session("cache_session")
+            assert agent._response_cache.get(("other_session", "Hello", 1, True, False)) == kept
+    
+    def test_process_turns_bulk(self):
+        """Test that bulk-ingested turns store the same memories as single turns"""
+        stored = self.agent.process_turns_bulk(
+            "bulk_session",
+            [("My preferred language is Kannada", 1), ("Filler message for turn 11", 11)]
+        )
+        
+        memories = self.agent.storage.get_session_memories("bulk_session")
+        assert stored == len(memories) > 0
+        assert self.agent.sessions["bulk_session"].turn_count == 11
+    
+    def test_recall_batch(self):
+        """Test that batched recall returns one read-only result per query"""
+        self.agent.process_turn("recall_session", "My preferred language is Kannada", turn_number=1)
+        
+        results = self.agent.recall_batch(
+            "recall_session",
+            ["What language do I prefer?", "What's my favorite movie?"],
+            turn_number=50
+        )
+        
+        assert [r["query"] for r in results] == ["What language do I prefer?", "What's my favorite movie?"]
+        assert len(results[0]["active_memories"]) > 0
+        assert self.agent.sessions["recall_session"].turn_count == 1
+    
+    def test_echo_mode(self):
+        """Test that echo mode replies with a fixed string but still extracts memories"""
+        agent = ConversationAgent(db_path=self.db_path, verbose=False, llm_mode="echo")
+        with contextlib.closing(agent):
+            response = agent.process_turn("echo_session", "Hello, my name is Asha", turn_number=1)
+            
+            assert response['assistant_response'] == ConversationAgent.ECHO_RESPONSE
+            assert len(response['extracted_memories']) > 0
+        
+        with pytest.raises(ValueError):
+            ConversationAgent(db_path=self.db_path, llm_mode="gpt")
+    
+    def test_shared_agent(self):
+        """Test that get_shared reuses one agent per configuration"""
+        try:
+            agent = ConversationAgent.get_shared(db_path=self.db_path, verbose=False)
+            assert ConversationAgent.get_shared(db_path=self.db_path, verbose=False) is agent
+            assert ConversationAgent.get_shared(db_path=self.db_path, llm_mode="echo") is not agent
+            
+            agent.process_turn("shared_session", "My preferred language is Kannada", turn_number=1)
+            agent.close_session("shared_session")
+            
+            assert "shared_session" not in agent.sessions
+            assert len(agent.storage.get_session_memories("shared_session")) > 0
+        finally:
+            ConversationAgent.close_shared()
+    
     def test_performance_metrics(self):
         """Test that performance metrics are tracked"""
         response = self.agent.process_turn(
@@ -366,6 +637,232 @@ class TestConversationAgent:
         assert 'performance' in response
         assert 'total_latency_ms' in response['performance']
         assert response['performance']['total_latency_ms'] > 0
+        assert len(response['perf_ns']) == 4
+        assert response['perf_ns'][0] > 0
+
+
+class StubEncoder:
+    """Deterministic bag-of-words encoder standing in for a sentence transformer"""
+    
+    DIMENSION = 64
+    
+    def get_sentence_embedding_dimension(self):
+        return self.DIMENSION
+    
+    def encode(self, texts, batch_size=32, show_progress_bar=False,
+               convert_to_numpy=True, normalize_embeddings=True):
+        embeddings = np.zeros((len(texts), self.DIMENSION), dtype=np.float32)
+        for row, text in zip(embeddings, texts):
+            for word in text.lower().split():
+                row[zlib.crc32(word.encode()) % self.DIMENSION] += 1.0
+            row /= max(np.linalg.norm(row), 1e-6)
+        return embeddings
+
+
+class TestVectorSearch:
+    """Test the FAISS paths with a stub encoder (needs faiss installed)"""
+    
+    @pytest.fixture(autouse=True)
+    def vector_search(self, tmp_path, monkeypatch):
+        import memory_storage
+        
+        self.faiss = pytest.importorskip("faiss")
+        monkeypatch.setattr(memory_storage, "VECTOR_SEARCH_AVAILABLE", True)
+        monkeypatch.setattr(memory_storage, "faiss", self.faiss, raising=False)
+        monkeypatch.setattr(MemoryStorage, "_load_encoder", lambda self, model, backend: StubEncoder())
+        
+        self.db_path = str(tmp_path / "test_memories.db")
+        self.index_dir = str(tmp_path / "embeddings")
+    
+    def _memory(self, session_id, content, turn=1):
+        return {
+            "session_id": session_id,
+            "type": "fact",
+            "content": content,
+            "key": "test",
+            "value": content,
+            "confidence": 0.8,
+            "source_turn": turn,
+            "created_at": "2024-01-01T00:00:00",
+            "last_accessed": None,
+            "access_count": 0,
+            "raw_text": content
+        }
+    
+    def _store_sample(self, storage, session_id="test_session"):
+        storage.store_memories([
+            self._memory(session_id, "language is Kannada", 1),
+            self._memory(session_id, "call after 11 AM", 2),
+            self._memory(session_id, "favorite color is green", 3),
+        ])
+    
+    @pytest.mark.parametrize("index_type", MemoryStorage.INDEX_TYPES)
+    def test_search_survives_reload(self, index_type):
+        """Test that each index type finds memories before and after a reload"""
+        with contextlib.closing(MemoryStorage(db_path=self.db_path, index_type=index_type)) as storage:
+            assert storage.vector_search_enabled
+            self._store_sample(storage)
+            
+            results = storage.search_memories_by_content("Kannada language", session_id="test_session", top_k=1)
+            assert [m['content'] for m in results] == ["language is Kannada"]
+        
+        with contextlib.closing(MemoryStorage(db_path=self.db_path, index_type=index_type)) as storage:
+            assert storage.index.ntotal == 3
+            results = storage.search_memories_by_content("Kannada language", session_id="test_session", top_k=1)
+            assert [m['content'] for m in results] == ["language is Kannada"]
+    
+    @pytest.mark.parametrize("index_type", MemoryStorage.INDEX_TYPES)
+    def test_delete_removes_vectors(self, index_type):
+        """Test that deleting a session drops its vectors where the index allows it"""
+        with contextlib.closing(MemoryStorage(db_path=self.db_path, index_type=index_type)) as storage:
+            self._store_sample(storage, "other_session")
+            self._store_sample(storage, "test_session")
+            
+            storage.delete_session_memories("other_session")
+            
+            # HNSW graphs can't remove vectors; the search skips them instead
+            assert storage.index.ntotal == (6 if index_type == "hnsw" else 3)
+            results = storage.search_memories_by_content("Kannada language", top_k=3)
+            assert [m['session_id'] for m in results] == ["test_session"] * 3
+    
+    @pytest.mark.parametrize("index_type", ["flat", "ivf"])
+    def test_unsaved_vectors_are_rebuilt_on_load(self, index_type):
+        """Test that rows whose vectors were never saved are re-indexed on load"""
+        with contextlib.closing(MemoryStorage(db_path=self.db_path, index_type=index_type, ivf_nlist=1)) as storage:
+            # Four memories are enough to train the "ivf" index (nlist=1)
+            self._store_sample(storage)
+            storage.store_memories([self._memory("test_session", "filler note", 4)])
+            storage.flush()
+            storage.store_memories([self._memory("test_session", "dog is named Rex", 5)])
+            
+            # Stop as if the process exited before the debounced save ran
+            storage._save_timer.cancel()
+            storage._index_dirty = False
+        
+        with contextlib.closing(MemoryStorage(db_path=self.db_path, index_type=index_type, ivf_nlist=1)) as storage:
+            stored_ids = [m['id'] for m in storage.get_session_memories("test_session")]
+            assert sorted(storage._indexed_ids().tolist()) == sorted(stored_ids)
+    
+    def test_ivf_trains_once_large_enough(self):
+        """Test that an "ivf" store switches from flat to a trained IVF index"""
+        with contextlib.closing(MemoryStorage(db_path=self.db_path, index_type="ivf", ivf_nlist=2)) as storage:
+            self._store_sample(storage)
+            assert isinstance(storage.index, self.faiss.IndexIDMap2)
+            
+            storage.store_memories([self._memory("test_session", f"filler fact number {i}", 10 + i) for i in range(6)])
+            assert not isinstance(storage.index, self.faiss.IndexIDMap2)
+            assert storage.index.ntotal == 9
+            
+            results = storage.search_memories_by_content("Kannada language", session_id="test_session", top_k=1)
+            assert [m['content'] for m in results] == ["language is Kannada"]
+    
+    def test_unkeyed_index_is_rebuilt(self):
+        """Test that a position-keyed index with no id map is rebuilt from SQL"""
+        with contextlib.closing(MemoryStorage(db_path=self.db_path)) as storage:
+            self._store_sample(storage)
+            memories = storage.get_session_memories("test_session")
+        
+        legacy_index = self.faiss.IndexFlatIP(StubEncoder.DIMENSION)
+        legacy_index.add(StubEncoder().encode([m['content'] for m in memories[::-1]]))
+        self.faiss.write_index(legacy_index, os.path.join(self.index_dir, "faiss.index"))
+        
+        with contextlib.closing(MemoryStorage(db_path=self.db_path)) as storage:
+            assert isinstance(storage.index, self.faiss.IndexIDMap2)
+            assert sorted(storage._indexed_ids().tolist()) == sorted(m['id'] for m in memories)
+            
+            results = storage.search_memories_by_content("Kannada language", top_k=1)
+            assert [m['content'] for m in results] == ["language is Kannada"]
+            
+            storage.delete_session_memories("test_session")
+            assert storage.index.ntotal == 0
+    
+    def test_legacy_id_map_migration(self):
+        """Test that a position-keyed index with a pickled id map is re-keyed on load"""
+        with contextlib.closing(MemoryStorage(db_path=self.db_path)) as storage:
+            self._store_sample(storage)
+            memories = storage.get_session_memories("test_session")
+        
+        # Rewrite the saved index the way older versions laid it out
+        legacy_index = self.faiss.IndexFlatIP(StubEncoder.DIMENSION)
+        legacy_index.add(StubEncoder().encode([m['content'] for m in memories]))
+        self.faiss.write_index(legacy_index, os.path.join(self.index_dir, "faiss.index"))
+        id_map_path = os.path.join(self.index_dir, "id_map.pkl")
+        with open(id_map_path, 'wb') as f:
+            pickle.dump([m['id'] for m in memories], f)
+        
+        with contextlib.closing(MemoryStorage(db_path=self.db_path)) as storage:
+            assert isinstance(storage.index, self.faiss.IndexIDMap2)
+            results = storage.search_memories_by_content("Kannada language", top_k=1)
+            assert [m['id'] for m in results] == [memories[0]['id']]
+            
+            storage._save_index()
+            assert not os.path.exists(id_map_path)
+
+
+class TestApiServer:
+    """Test REST endpoints against a background-storage agent"""
+    
+    @pytest.fixture(autouse=True)
+    def client(self, tmp_path, monkeypatch):
+        import api_server
+        
+        agent = ConversationAgent(db_path=str(tmp_path / "test_memories.db"), background_storage=True)
+        
+        # Slow the background write so a read that doesn't wait for it
+        # would reliably miss this turn's memories
+        store_memories = agent.storage.store_memories
+        def slow_store_memories(memories):
+            time.sleep(0.05)
+            return store_memories(memories)
+        monkeypatch.setattr(agent.storage, "store_memories", slow_store_memories)
+        
+        monkeypatch.setattr(api_server, "agent", agent)
+        with contextlib.closing(agent):
+            self.client = api_server.app.test_client()
+            yield
+    
+    def test_memories_include_latest_turn(self):
+        """Test that /memories sees the memories a /conversation turn just extracted"""
+        for turn, message in enumerate(["My preferred language is Kannada", "Please call me Arun"], 1):
+            turn_response = self.client.post("/conversation", json={
+                "session_id": "api_session",
+                "user_message": message,
+                "turn_number": turn
+            }).get_json()
+            assert len(turn_response["extracted_memories"]) > 0
+            
+            stored = self.client.get("/memories/api_session").get_json()["memories"]
+            contents = {m["content"] for m in stored}
+            assert all(m["content"] in contents for m in turn_response["extracted_memories"])
+    
+    @pytest.mark.parametrize("flag, minimal", [
+        ("1", True), ("TRUE", True), ("on", True),
+        ("0", False), ("False", False), ("no", False), ("off", False),
+    ])
+    def test_minimal_flag(self, flag, minimal):
+        """Test that ?minimal only switches minimal mode on for true values"""
+        response = self.client.post(f"/conversation?minimal={flag}", json={
+            "session_id": "api_session",
+            "user_message": "Hello",
+            "turn_number": 1
+        }).get_json()
+        
+        assert ("extracted_memories" not in response) == minimal
+    
+    def test_memories_page_reports_total(self):
+        """Test that a page of /memories reports the total across all pages"""
+        self.client.post("/conversation", json={
+            "session_id": "api_session",
+            "user_message": "My preferred language is Kannada. Please call me Arun.",
+            "turn_number": 1
+        })
+        
+        everything = self.client.get("/memories/api_session").get_json()
+        page = self.client.get("/memories/api_session?limit=1").get_json()
+        
+        assert everything["total_memories"] > 1
+        assert len(page["memories"]) == 1
+        assert page["total_memories"] == everything["total_memories"]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+"""
+WSGI entry point for running the API server under a production server
+
+Example:
+    gunicorn -w 4 --threads 2 wsgi:app
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from api_server import app  # noqa: E402